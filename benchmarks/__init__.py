@@ -0,0 +1,2 @@
+"""Benchmarks of the border crossing statistics scripts. Each module runs as a
+   script (python3 benchmarks/<module>.py --help)."""
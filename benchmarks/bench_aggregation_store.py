@@ -0,0 +1,74 @@
+"""Benchmarks the aggregation stage of the optimized script: the NestedDict
+   (result[[border, measure, date, value]] = 0 for every row) against the
+   flat CrossingTotals store (optimized_engine.CrossingTotals).
+
+   Usage: python3 benchmarks/bench_aggregation_store.py --rows 1000000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from synthetic import write_synthetic_csv  # noqa: E402
+from utils import scan_records  # noqa: E402
+from optimized_engine import CrossingTotals, NestedDict  # noqa: E402
+
+
+def nested_dict_path(records):
+    result = NestedDict()
+    for border, date, measure, value in records:
+        result[[border, measure, date, value]] = 0
+    return result
+
+
+def crossing_totals_path(records):
+    result = CrossingTotals()
+    for border, date, measure, value in records:
+        result.add(border, measure, date, value)
+    return result
+
+
+def measure(function, records):
+    """Returns the seconds the function took and the memory its result holds."""
+    start = time.perf_counter()
+    function(records)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = function(records)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+
+    return seconds, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the aggregation store')
+    parser.add_argument('--rows', help="number of synthetic rows", type=int,
+                        default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, 'Border_Crossing_Entry_Data.csv')
+        write_synthetic_csv(filename, args.rows)
+        records = list(scan_records(filename))
+
+    nested_time, nested_memory = measure(nested_dict_path, records)
+    store_time, store_memory = measure(crossing_totals_path, records)
+
+    print('rows:              {}'.format(len(records)))
+    print('NestedDict:        {:.3f} s, {:.1f} MB held'.format(nested_time,
+                                                             nested_memory / 2 ** 20))
+    print('CrossingTotals:    {:.3f} s, {:.1f} MB held'.format(store_time,
+                                                             store_memory / 2 ** 20))
+    print('speedup:           {:.1f}x'.format(nested_time / store_time))
+
+
+if __name__ == '__main__':
+    main()
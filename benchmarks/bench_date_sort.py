@@ -0,0 +1,61 @@
+"""Benchmarks sorting the report rows by date with a datetime.strptime sort key
+   against the interned integer date index (utils.DateIndex).
+
+   Usage: python3 benchmarks/bench_date_sort.py --rows 1000000
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from synthetic import write_synthetic_csv  # noqa: E402
+from utils import DateIndex  # noqa: E402
+
+
+def time_sort(rows, key):
+    """Returns the sorted rows and the number of seconds the sort took."""
+    start = time.perf_counter()
+    sorted_rows = sorted(rows, key=key, reverse=True)
+    return sorted_rows, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the date sort key')
+    parser.add_argument('--rows', help="number of synthetic rows", type=int,
+                        default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, 'Border_Crossing_Entry_Data.csv')
+        write_synthetic_csv(filename, args.rows)
+
+        # Keep only the report columns: Border, Date, Measure, Value
+        with open(filename, mode='r') as csv_file:
+            csv_reader = csv.reader(csv_file, delimiter=',')
+            next(csv_reader)
+            rows = [[row[3], row[4], row[5], int(row[6])] for row in csv_reader]
+
+    strptime_sorted, strptime_time = time_sort(
+        rows, lambda x: datetime.strptime(x[1], '%m/%d/%Y %I:%M:%S %p'))
+
+    date_index = DateIndex()
+    index_sorted, index_time = time_sort(rows, lambda x: date_index[x[1]])
+
+    assert strptime_sorted == index_sorted
+
+    print('rows:              {}'.format(len(rows)))
+    print('distinct dates:    {}'.format(len(date_index)))
+    print('strptime key:      {:.3f} s'.format(strptime_time))
+    print('DateIndex key:     {:.3f} s'.format(index_time))
+    print('speedup:           {:.1f}x'.format(strptime_time / index_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmarks emitting the report rows of the optimized script: the old
+   find_the_bloody_key, which rebuilt the flattened list of pairs on every
+   month (O(n^2) per series), against the linear generator of
+   optimized_engine.find_the_bloody_key, on series of 300 months and more.
+
+   Usage: python3 benchmarks/bench_emission.py [--months 300 600 1200]
+                  [--series 24]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from itertools import chain
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import DateIndex  # noqa: E402
+from optimized_engine import CrossingTotals, cumulative_average, find_average  # noqa: E402
+from optimized_engine import find_the_bloody_key  # noqa: E402
+
+
+def quadratic_find_the_bloody_key(total_list, result_key, measure_key, measure_values):
+    # The old emission loop, kept for comparison (without its one value case)
+    new_total_list = []
+    i = 0
+    for key in measure_values.keys():
+        if len(list(chain(*total_list))) > 2:
+            if total_list[i][0] in measure_values.values() and i < len(list(chain(*total_list))):
+                new_total_list.append([result_key, key, measure_key, total_list[i][0],
+                                       total_list[i][1]])
+                i += 1
+    return new_total_list
+
+
+def synthetic_totals(num_series, num_months, seed=0):
+    """Builds a CrossingTotals of num_series series of num_months months each."""
+    rng = random.Random(seed)
+    result = CrossingTotals()
+    for series in range(num_series):
+        for month in range(2019 * 12 + 11 - num_months, 2019 * 12 + 11):
+            date = '{:02d}/01/{} 12:00:00 AM'.format(month % 12 + 1, month // 12)
+            result.add('Border {}'.format(series % 2), 'Measure {}'.format(series), date,
+                       rng.randrange(10 ** 6))
+    return result
+
+
+def time_emission(emit, result):
+    """Returns the seconds the emission of every series took (without the sort)."""
+    date_index = DateIndex()
+    series = []
+    for (border, measure), measure_value in result.series().items():
+        measure_values = {date: measure_value[date]
+                          for date in sorted(measure_value, key=date_index.__getitem__,
+                                             reverse=True)}
+        series.append((cumulative_average(list(measure_values.values())), border, measure,
+                       measure_values))
+
+    start = time.perf_counter()
+    rows = 0
+    for total_list, border, measure, measure_values in series:
+        for _ in emit(total_list, border, measure, measure_values):
+            rows += 1
+    return time.perf_counter() - start, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the report row emission')
+    parser.add_argument('--months', help="months of each series", type=int, nargs='+',
+                        default=[300, 600, 1200])
+    parser.add_argument('--series', help="number of (Border, Measure) series", type=int,
+                        default=24)
+    args = parser.parse_args()
+
+    for num_months in args.months:
+        result = synthetic_totals(args.series, num_months)
+        old_seconds, rows = time_emission(quadratic_find_the_bloody_key, result)
+        new_seconds, _ = time_emission(find_the_bloody_key, result)
+
+        start = time.perf_counter()
+        find_average(result)
+        total_seconds = time.perf_counter() - start
+
+        print('{} months x {} series ({} rows): old {:.3f} s, new {:.4f} s ({:.0f}x), '
+              'find_average with the sort {:.3f} s'.format(
+                  num_months, args.series, rows, old_seconds, new_seconds,
+                  old_seconds / new_seconds, total_seconds))
+
+
+if __name__ == '__main__':
+    main()
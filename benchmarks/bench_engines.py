@@ -0,0 +1,252 @@
+"""Benchmarks the three scripts (border_crossing_statistics.py,
+   border_crossing_statistics_optimized.py, and SQL_border_crossing_statistics.py)
+   on a synthetic dataset: end to end in a child process (wall time, peak RSS,
+   and input rows/sec), and phase by phase in this process (parse, aggregate,
+   average, sort, write). Each run is appended to a JSON history and compared
+   with the last run on the same dataset.
+
+   Usage: python3 benchmarks/bench_engines.py --rows 1000000
+                  [--ports 100] [--years 20] [--sparsity 0.1] [--duplicates 0.05]
+                  [--history benchmarks/history.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from synthetic import write_synthetic_csv  # noqa: E402
+from utils import DateIndex, input_records, write_to_csv  # noqa: E402
+from utils import calculate_running_average, sort_report  # noqa: E402
+from optimized_engine import CrossingTotals, find_average  # noqa: E402
+from sql_engine import load_bct_table, restore_dates, report_query  # noqa: E402
+from sql_engine import CREATE_CROSSINGS_TABLE, CREATE_CROSSINGS_INDEX  # noqa: E402
+from border_crossing_statistics import read_and_aggregate  # noqa: E402
+
+SCRIPTS = ['border_crossing_statistics', 'border_crossing_statistics_optimized',
+           'SQL_border_crossing_statistics']
+
+
+class PhaseTimer(dict):
+    """Dictionary of the seconds each phase took."""
+
+    @contextmanager
+    def __call__(self, phase):
+        start = time.perf_counter()
+        yield
+        self[phase] = self.get(phase, 0.0) + time.perf_counter() - start
+
+
+def brute_force_phases(input_file, output_file):
+    timer = PhaseTimer()
+    with timer('parse'):
+        records = list(input_records(input_file))
+    with timer('aggregate'):
+        list_with_agg_values = read_and_aggregate(records)
+    with timer('average'):
+        date_index = DateIndex()
+        list_with_avg = calculate_running_average(list_with_agg_values, date_index)
+    with timer('sort'):
+        final_sorted_list = sort_report(list_with_avg, date_index)
+    with timer('write'):
+        write_to_csv(output_file, final_sorted_list)
+    return timer
+
+
+def optimized_phases(input_file, output_file):
+    # find_average sorts the rows it averages, so the sort is in 'average'
+    timer = PhaseTimer()
+    with timer('parse'):
+        records = list(input_records(input_file))
+    with timer('aggregate'):
+        result = CrossingTotals()
+        for border, date, measure, value in records:
+            result.add(border, measure, date, value)
+    with timer('average'):
+        final_list = find_average(result)
+    with timer('write'):
+        write_to_csv(output_file, final_list)
+    return timer
+
+
+def sql_phases(input_file, output_file):
+    # The window query averages and sorts in one statement, so the sort is
+    # in 'average'
+    timer = PhaseTimer()
+    with timer('parse'):
+        records = list(input_records(input_file))
+    with timer('aggregate'):
+        connection = sqlite3.connect(':memory:')
+        date_index = DateIndex()
+        load_bct_table(connection, records, date_index)
+        connection.execute(CREATE_CROSSINGS_TABLE)
+        connection.execute(CREATE_CROSSINGS_INDEX)
+    with timer('average'):
+        query, parameters = report_query()
+        rows = connection.execute(query, parameters).fetchall()
+    with timer('write'):
+        write_to_csv(output_file, restore_dates(rows, date_index))
+    connection.close()
+    return timer
+
+
+PHASES = {'border_crossing_statistics': brute_force_phases,
+          'border_crossing_statistics_optimized': optimized_phases,
+          'SQL_border_crossing_statistics': sql_phases}
+
+# Runs a script (or, without one, nothing) as __main__ in the child process,
+# then writes the peak RSS of the child to a file. ru_maxrss of a child also
+# counts the pages of the process it was forked from (Linux keeps the high
+# water mark across exec), so where there is a /proc the child reports its
+# own VmHWM instead
+LAUNCHER = '''
+import sys
+import runpy
+rss_file, script = sys.argv[1], sys.argv[2]
+try:
+    if script:
+        sys.argv = sys.argv[2:]
+        sys.path[0] = {src!r}
+        runpy.run_path(script, run_name='__main__')
+finally:
+    try:
+        with open('/proc/self/status') as status:
+            peak = [line.split()[1] for line in status if line.startswith('VmHWM:')]
+    except OSError:
+        peak = []
+    with open(rss_file, mode='w') as out:
+        out.write(peak[0] if peak else '')
+'''.format(src=SRC)
+
+
+def run_end_to_end(script, input_file, output_file, tmp_dir):
+    """Runs the script in a child process (see LAUNCHER). Without a script,
+       measures an idle interpreter.
+
+    Returns:
+        seconds (float): wall time
+        peak_rss_kb (int): peak resident set size of the child process
+    """
+    rss_file = os.path.join(tmp_dir, 'peak_rss')
+    command = [sys.executable, '-c', LAUNCHER, rss_file, '']
+    if script:
+        command[-1:] = [os.path.join(SRC, script + '.py'), '--input', input_file,
+                        '--output', output_file]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command)
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError('{} exited with {}'.format(script, process.returncode))
+
+    with open(rss_file, mode='r') as peak_file:
+        peak_rss = peak_file.read()
+    if peak_rss:
+        return seconds, int(peak_rss)
+
+    # Without a /proc, fall back to ru_maxrss (in kilobytes on Linux and
+    # in bytes on macOS), which may count some of this process too
+    peak_rss = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return seconds, peak_rss
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_history(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename, mode='r') as history_file:
+        return json.load(history_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the three scripts')
+    parser.add_argument('--rows', help="number of synthetic rows", type=int,
+                        default=1000000)
+    parser.add_argument('--ports', help="number of ports", type=int, default=100)
+    parser.add_argument('--years', help="number of years of history", type=int)
+    parser.add_argument('--sparsity', help="chance a port skips a measure in a month",
+                        type=float, default=0.0)
+    parser.add_argument('--duplicates', help="chance a row is repeated", type=float,
+                        default=0.0)
+    parser.add_argument('--scripts', help="scripts to benchmark (all by default)",
+                        nargs='+', choices=SCRIPTS, default=SCRIPTS)
+    parser.add_argument('--history', help="JSON file the runs are appended to",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                             'history.json'))
+    args = parser.parse_args()
+
+    dataset = {'rows': args.rows, 'ports': args.ports, 'years': args.years,
+               'sparsity': args.sparsity, 'duplicates': args.duplicates}
+    results = dict()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'Border_Crossing_Entry_Data.csv')
+        output_file = os.path.join(tmp_dir, 'report.csv')
+        rows = write_synthetic_csv(input_file, args.rows, args.ports, years=args.years,
+                                   sparsity=args.sparsity, duplicates=args.duplicates)
+
+        # The peak RSS of an idle interpreter, so the memory each script
+        # takes on top of it can be told apart. The end to end runs go
+        # first, since without a /proc the peak RSS of a child includes the
+        # peak RSS of this process, which the phase runs would raise
+        _, idle_rss = run_end_to_end(None, input_file, output_file, tmp_dir)
+        for script in args.scripts:
+            seconds, peak_rss = run_end_to_end(script, input_file, output_file, tmp_dir)
+            results[script] = {'wall_seconds': round(seconds, 4),
+                               'peak_rss_kb': peak_rss,
+                               'rows_per_second': round(rows / seconds)}
+
+        for script in args.scripts:
+            phases = PHASES[script](input_file, output_file)
+            results[script]['phases'] = {phase: round(phase_seconds, 4)
+                                         for phase, phase_seconds in phases.items()}
+
+    history = load_history(args.history)
+    previous = next((run for run in reversed(history) if run['dataset'] == dataset), None)
+    history.append({'timestamp': datetime.now().isoformat(timespec='seconds'),
+                    'commit': git_commit(),
+                    'python': platform.python_version(),
+                    'dataset': dataset,
+                    'input_rows': rows,
+                    'idle_rss_kb': idle_rss,
+                    'results': results})
+    with open(args.history, mode='w') as history_file:
+        json.dump(history, history_file, indent=2)
+
+    print('input rows:        {}'.format(rows))
+    print('idle interpreter:  {} KB peak RSS'.format(idle_rss))
+    for script, result in results.items():
+        change = ''
+        if previous and script in previous['results']:
+            before = previous['results'][script]['wall_seconds']
+            change = ' ({:+.1%} vs {})'.format(result['wall_seconds'] / before - 1,
+                                               previous['commit'] or previous['timestamp'])
+        print('{}: {:.3f} s, {} KB peak RSS ({} KB over idle), {} rows/s{}'.format(
+            script, result['wall_seconds'], result['peak_rss_kb'],
+            result['peak_rss_kb'] - idle_rss, result['rows_per_second'], change))
+        print('    ' + ', '.join('{} {:.3f} s'.format(phase, phase_seconds)
+                                 for phase, phase_seconds in result['phases'].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Benchmarks writing the report: a csv.writer writerow call per row (the old
+   write_to_csv) against the batched and buffered utils.ReportWriter, and
+   the ReportWriter with gzip compressed output.
+
+   Usage: python3 benchmarks/bench_report_writer.py --rows 1000000
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from synthetic import BORDERS, MEASURES  # noqa: E402
+from utils import ReportWriter  # noqa: E402
+
+
+def synthetic_report(num_rows, seed=0):
+    """Builds report rows (<Border>, <Date>, <Measure>, <Value>, <Average>)."""
+    rng = random.Random(seed)
+    rows, month = [], 2019 * 12 + 11
+    while len(rows) < num_rows:
+        date = '{:02d}/01/{} 12:00:00 AM'.format(month % 12 + 1, month // 12)
+        for border in BORDERS:
+            for measure in MEASURES:
+                rows.append([border, date, measure, rng.randrange(10 ** 6),
+                             rng.randrange(10 ** 6)])
+        month -= 1
+    return rows[:num_rows]
+
+
+def csv_writerow_path(filename, rows):
+    with open(filename, mode='w') as csv_outfile:
+        outfile_writer = csv.writer(csv_outfile, delimiter=',', quotechar='"',
+                                    quoting=csv.QUOTE_NONE)
+        outfile_writer.writerow(['Border', 'Date', 'Measure', 'Value', 'Average'])
+        outfile_writer = csv.writer(csv_outfile, delimiter=',', quotechar='"',
+                                    quoting=csv.QUOTE_MINIMAL)
+        for row in rows:
+            outfile_writer.writerow(row)
+
+
+def report_writer_path(filename, rows):
+    with ReportWriter(filename) as writer:
+        writer.write_rows(rows)
+
+
+def measure(function, filename, rows):
+    """Returns the seconds the function took and the size of the file it wrote."""
+    start = time.perf_counter()
+    function(filename, rows)
+    return time.perf_counter() - start, os.path.getsize(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the report writer')
+    parser.add_argument('--rows', help="number of report rows", type=int,
+                        default=1000000)
+    args = parser.parse_args()
+
+    rows = synthetic_report(args.rows)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [('csv.writerow:', measure(csv_writerow_path,
+                                             os.path.join(tmp_dir, 'a.csv'), rows)),
+                   ('ReportWriter:', measure(report_writer_path,
+                                             os.path.join(tmp_dir, 'b.csv'), rows)),
+                   ('ReportWriter (gz):', measure(report_writer_path,
+                                                  os.path.join(tmp_dir, 'c.csv.gz'), rows))]
+
+    print('rows:              {}'.format(len(rows)))
+    for name, (seconds, size) in results:
+        print('{:<19}{:.3f} s, {:.0f} rows/s, {:.1f} MB/s written ({:.1f} MB)'.format(
+            name, seconds, len(rows) / seconds, size / seconds / 2 ** 20, size / 2 ** 20))
+    print('speedup:           {:.1f}x'.format(results[0][1][0] / results[1][1][0]))
+
+
+if __name__ == '__main__':
+    main()
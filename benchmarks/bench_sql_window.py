@@ -0,0 +1,85 @@
+"""Benchmarks the SQL engine's running average: the old correlated subquery
+   against the window function over the indexed crossings table
+   (sql_engine.REPORT_QUERY), on a synthetic 20 year, 100 port dataset.
+
+   Usage: python3 benchmarks/bench_sql_window.py --years 20 --ports 100
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from synthetic import MEASURES, write_synthetic_csv  # noqa: E402
+from sql_engine import CREATE_CROSSINGS_TABLE, CREATE_CROSSINGS_INDEX, REPORT_QUERY  # noqa: E402
+from utils import DateIndex, csv_records  # noqa: E402
+
+CORRELATED_SUBQUERY = ("WITH crossings as ("
+                       "SELECT Border, Date, Measure, SUM(VALUE) as SumField "
+                       "FROM bct "
+                       "GROUP BY Border, Date, Measure) "
+                       "SELECT Border, Date, Measure, SumField,"
+                       "ifnull((SELECT cast(round(avg(c2.SumField), 0) AS INTEGER) "
+                       "FROM crossings AS c2 "
+                       "WHERE c2.Border = c.Border "
+                       "AND c2.Measure = c.Measure "
+                       "AND c2.Date < c.Date),0) AS Average "
+                       "FROM crossings AS c "
+                       "ORDER BY Date DESC, SumField DESC, Border, Measure DESC")
+
+
+def load(filename):
+    """Loads the synthetic file into an in-memory SQLite bct table, with
+       the dates in a sortable YYYY-MM-DD format."""
+
+    date_index = DateIndex()
+
+    def sql_date(date):
+        month = date_index[date]
+        return '{}-{:02d}-01'.format(month // 12, month % 12 + 1)
+
+    connection = sqlite3.connect(':memory:')
+    connection.execute("CREATE TABLE bct (Border TEXT, Date TEXT, Measure TEXT, Value INTEGER)")
+    connection.executemany("INSERT INTO bct VALUES (?, ?, ?, ?)",
+                           ((border, sql_date(date), measure, value)
+                            for border, date, measure, value in csv_records(filename)))
+    return connection
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SQL running average')
+    parser.add_argument('--years', help="years of monthly data", type=int, default=20)
+    parser.add_argument('--ports', help="number of ports", type=int, default=100)
+    args = parser.parse_args()
+
+    rows = args.years * 12 * args.ports * len(MEASURES)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, 'Border_Crossing_Entry_Data.csv')
+        write_synthetic_csv(filename, rows, num_ports=args.ports)
+        connection = load(filename)
+
+    start = time.perf_counter()
+    correlated = connection.execute(CORRELATED_SUBQUERY).fetchall()
+    correlated_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    connection.execute(CREATE_CROSSINGS_TABLE)
+    connection.execute(CREATE_CROSSINGS_INDEX)
+    window = connection.execute(REPORT_QUERY).fetchall()
+    window_time = time.perf_counter() - start
+
+    assert correlated == window
+
+    print('input rows:          {}'.format(rows))
+    print('report rows:         {}'.format(len(window)))
+    print('correlated subquery: {:.3f} s'.format(correlated_time))
+    print('window function:     {:.3f} s'.format(window_time))
+    print('speedup:             {:.1f}x'.format(correlated_time / window_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Benchmarks the import time of each script (python -X importtime), and fails
+   if one got slower than its baseline or imports a module it should only
+   import when asked to (asyncio for --pipeline, numpy for --engine numpy, ...).
+   Each import time is compared as a ratio to the import time of a standard
+   library module, so a slower (or busier) machine does not fail the benchmark.
+
+   Usage: python3 benchmarks/bench_startup.py [--runs 7] [--tolerance 0.25]
+                  [--baseline benchmarks/startup_baseline.json] [--update]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# The modules each entry point must not import at startup
+CSV_ENGINE_LAZY = ['asyncio', 'concurrent.futures', 'numpy', 'sqlite3', 'gzip',
+                   'bz2', 'lzma', 'zipfile', 'tracemalloc', 'cProfile',
+                   'pipeline', 'compression', 'input_cache', 'series_index',
+                   'pandas', 'sqlalchemy']
+ENTRY_POINTS = {
+    'utils': CSV_ENGINE_LAZY,
+    'border_crossing_statistics': CSV_ENGINE_LAZY,
+    'border_crossing_statistics_optimized': CSV_ENGINE_LAZY,
+    'SQL_border_crossing_statistics': [name for name in CSV_ENGINE_LAZY
+                                       if name != 'sqlite3'],
+    'report': CSV_ENGINE_LAZY,
+    # http.server imports shutil, which imports bz2 and lzma
+    'serve': [name for name in CSV_ENGINE_LAZY
+              if name not in ('series_index', 'bz2', 'lzma')],
+}
+
+# Pure Python standard library module each import time is divided by, so
+# the baseline holds ratios that do not depend on how fast (or busy) the
+# machine is
+REFERENCE_MODULE = 'email.message'
+
+
+def import_time(module):
+    """Imports the module in a fresh interpreter with -X importtime.
+
+    Returns:
+        cumulative_us (int): microseconds the import of the module took
+        imported (set): names of all the modules it imported
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                              'import ' + module], cwd=SRC, capture_output=True,
+                             text=True)
+    if process.returncode:
+        raise RuntimeError('import {} failed:\n{}'.format(module, process.stderr))
+
+    cumulative_us, imported = None, set()
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        if name.strip() == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us, imported
+
+
+def load_baseline(filename):
+    if not os.path.exists(filename):
+        return dict()
+    with open(filename, mode='r') as baseline_file:
+        return json.load(baseline_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the scripts')
+    parser.add_argument('--runs', help="imports of each script (the median ratio is kept)",
+                        type=int, default=7)
+    parser.add_argument('--tolerance', help="allowed slowdown against the baseline",
+                        type=float, default=0.25)
+    parser.add_argument('--baseline', help="JSON file of the baseline import time ratios",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                             'startup_baseline.json'))
+    parser.add_argument('--update', help="write the import time ratios out as the baseline",
+                        action='store_true')
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results, failures = dict(), []
+
+    # Import the reference module right before each script, and keep the
+    # median of the ratios of their import times, so a change in the load
+    # of the machine during the benchmark hits both alike
+    for module, lazy_modules in ENTRY_POINTS.items():
+        ratios, times = [], []
+        for _ in range(args.runs):
+            reference_us, _ = import_time(REFERENCE_MODULE)
+            cumulative_us, imported = import_time(module)
+            ratios.append(cumulative_us / reference_us)
+            times.append(cumulative_us)
+        ratio = statistics.median(ratios)
+        results[module] = round(ratio, 4)
+
+        change = ''
+        if module in baseline:
+            before = baseline[module]
+            change = ' ({:+.1%} vs baseline)'.format(ratio / before - 1)
+            if ratio > before * (1 + args.tolerance):
+                failures.append('{} imports in {:.2f}x {}, baseline {:.2f}x'.format(
+                    module, ratio, REFERENCE_MODULE, before))
+        eager = sorted(name for name in lazy_modules if name in imported)
+        if eager:
+            failures.append('{} imports {} at startup'.format(module, ', '.join(eager)))
+        print('{}: {:.1f} ms, {:.2f}x {}{}'.format(module, min(times) / 1000, ratio,
+                                                  REFERENCE_MODULE, change))
+
+    if args.update:
+        with open(args.baseline, mode='w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print('wrote the baseline to {}'.format(args.baseline))
+
+    for failure in failures:
+        print('FAIL: ' + failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
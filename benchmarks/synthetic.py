@@ -0,0 +1,108 @@
+"""Builds synthetic border crossing entry data files for the benchmarks.
+
+   Usage: python3 benchmarks/synthetic.py --output data.csv --rows 1000000
+                  [--ports 100] [--borders 2] [--measures 12] [--years 20]
+                  [--sparsity 0.1] [--duplicates 0.05] [--seed 0]
+"""
+
+import argparse
+import csv
+import random
+
+BORDERS = ['US-Canada Border', 'US-Mexico Border']
+
+MEASURES = ['Bus Passengers', 'Buses', 'Pedestrians', 'Personal Vehicle Passengers',
+            'Personal Vehicles', 'Rail Containers Empty', 'Rail Containers Full',
+            'Train Passengers', 'Trains', 'Truck Containers Empty',
+            'Truck Containers Full', 'Trucks']
+
+HEADER = ['Port Name', 'State', 'Port Code', 'Border', 'Date', 'Measure', 'Value',
+          'Location']
+
+
+def write_synthetic_csv(filename, num_rows=None, num_ports=100, seed=0, borders=BORDERS,
+                        measures=MEASURES, years=None, sparsity=0.0, duplicates=0.0):
+    """Writes a csv file shaped like the border crossing entry data: the most
+       recent month comes first and every port reports every measure each month.
+
+    Args:
+        filename: name of the csv file to write
+        num_rows: number of rows to write, not counting the header (no limit
+                  if None, then years must be given)
+        num_ports: number of distinct ports
+        seed: seed for the random values, so runs are repeatable
+        borders: the borders the ports are spread over
+        measures: the measures each port reports
+        years: number of years of history (no limit if None)
+        sparsity: chance that a port does not report a measure in a month
+        duplicates: chance that a row is written out twice
+
+    Returns:
+        rows_written (int): number of rows written
+    """
+
+    if num_rows is None and years is None:
+        raise ValueError('Either the number of rows or of years must be given')
+
+    rng = random.Random(seed)
+    ports = [('Port {}'.format(i), 'State', str(100 + i), borders[i % len(borders)],
+              'POINT (-{:.5f} {:.5f})'.format(rng.uniform(60, 120), rng.uniform(25, 50)))
+             for i in range(num_ports)]
+
+    last_month = 2019 * 12 + 2
+    first_month = None if years is None else last_month - 12 * years + 1
+
+    with open(filename, mode='w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(HEADER)
+
+        rows_written, month = 0, last_month
+        while first_month is None or month >= first_month:
+            date = '{:02d}/01/{} 12:00:00 AM'.format(month % 12 + 1, month // 12)
+            for name, state, code, border, location in ports:
+                for measure in measures:
+                    if sparsity and rng.random() < sparsity:
+                        continue
+
+                    row = [name, state, code, border, date, measure,
+                           rng.randint(0, 100000), location]
+                    for _ in range(2 if duplicates and rng.random() < duplicates else 1):
+                        if rows_written == num_rows:
+                            return rows_written
+                        writer.writerow(row)
+                        rows_written += 1
+            month -= 1
+
+    return rows_written
+
+
+def synthetic_names(names, count, template):
+    """Returns the first count names, made up from the template past the end."""
+    return names[:count] + [template.format(i) for i in range(len(names), count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a synthetic border crossing csv file')
+    parser.add_argument('--output', help="name of the csv file to write", required=True)
+    parser.add_argument('--rows', help="number of rows", type=int)
+    parser.add_argument('--ports', help="number of ports", type=int, default=100)
+    parser.add_argument('--borders', help="number of borders", type=int, default=len(BORDERS))
+    parser.add_argument('--measures', help="number of measures", type=int,
+                        default=len(MEASURES))
+    parser.add_argument('--years', help="number of years of history", type=int)
+    parser.add_argument('--sparsity', help="chance a port skips a measure in a month",
+                        type=float, default=0.0)
+    parser.add_argument('--duplicates', help="chance a row is repeated", type=float,
+                        default=0.0)
+    parser.add_argument('--seed', help="random seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = write_synthetic_csv(args.output, args.rows, args.ports, args.seed,
+                               synthetic_names(BORDERS, args.borders, 'Border {}'),
+                               synthetic_names(MEASURES, args.measures, 'Measure {}'),
+                               args.years, args.sparsity, args.duplicates)
+    print('wrote {} rows to {}'.format(rows, args.output))
+
+
+if __name__ == '__main__':
+    main()
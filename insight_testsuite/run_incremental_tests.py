@@ -0,0 +1,185 @@
+"""Checks that the incremental runs report the same as a full run of the whole
+   input file: the aggregate state of border_crossing_statistics.py (--state,
+   then --append) and the warehouse of SQL_border_crossing_statistics.py (--db).
+
+   The input file is split by month into a history, its last month (a new
+   month), and a month in between (a backfill, which changes the averages of
+   the months after it). Both scripts are run on the history, then on the new
+   month, then on the backfill:
+
+       --append prints only the rows it recalculated, so the rows of each
+                run are laid over the report of the history, which then has
+                to be the full report. Appending the new month again has to
+                fail and leave the state file as it was.
+       --db     prints the whole report out of the warehouse, which has to be
+                the report of a full run of the rows ingested so far. Ingesting
+                the new month again has to leave the report as it was.
+
+   Usage: python3 insight_testsuite/run_incremental_tests.py
+                  [--input input/Border_Crossing_Entry_Data_SQL_test.csv]
+"""
+
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+
+from datetime import datetime
+
+PROJECT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(PROJECT_PATH, 'src')
+
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+
+def read_csv(filename):
+    """Returns the header and the rows of a csv file."""
+    with open(filename, mode='r', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        header = next(csv_reader)
+        return header, list(csv_reader)
+
+
+def write_csv(filename, header, rows):
+    with open(filename, mode='w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',')
+        csv_writer.writerow(header)
+        csv_writer.writerows(rows)
+
+
+def split_by_month(filename, tmp_dir):
+    """Splits the input file into the history, the new (last) month, and the
+       backfill (a month in between), and writes each part out.
+
+    Returns:
+        parts (list): names of the history, new month, and backfill files
+    """
+
+    header, rows = read_csv(filename)
+    date = header.index('Date')
+    months = sorted({row[date] for row in rows},
+                    key=lambda month: datetime.strptime(month, DATE_FORMAT))
+    if len(months) < 3:
+        raise SystemExit('{} needs at least 3 months of data'.format(filename))
+    new_month, backfill = months[-1], months[len(months) // 2]
+
+    parts = []
+    for name, in_part in (('history', lambda month: month not in (new_month, backfill)),
+                          ('new_month', lambda month: month == new_month),
+                          ('backfill', lambda month: month == backfill)):
+        parts.append(os.path.join(tmp_dir, name + '.csv'))
+        write_csv(parts[-1], header, [row for row in rows if in_part(row[date])])
+    return parts
+
+
+def run(script, input_file, output_file, *flags):
+    """Runs a script, and returns the header and rows of its report (None if
+       the script failed)."""
+    process = subprocess.run([sys.executable, os.path.join(SRC, script),
+                              '--input', input_file, '--output', output_file] + list(flags),
+                             capture_output=True, text=True)
+    if process.returncode:
+        return None
+    return read_csv(output_file)
+
+
+def report_by_key(report):
+    """Maps the (Border, Date, Measure) of each row of a report to the row."""
+    header, rows = report
+    border, date, measure = (header.index(column) for column in ('Border', 'Date', 'Measure'))
+    return {(row[border], row[date], row[measure]): row for row in rows}
+
+
+def check_state(input_file, parts, tmp_dir):
+    """Checks --state and --append against a full run.
+
+    Returns:
+        failures (list): what did not match
+    """
+
+    output_file = os.path.join(tmp_dir, 'state_report.csv')
+    state_file = os.path.join(tmp_dir, 'state.json')
+    full = report_by_key(run('border_crossing_statistics.py', input_file, output_file))
+
+    history, new_month, backfill = parts
+    report = report_by_key(run('border_crossing_statistics.py', history, output_file,
+                               '--state', state_file))
+    failures = []
+    for name, part in (('new month', new_month), ('backfill', backfill)):
+        appended = run('border_crossing_statistics.py', part, output_file,
+                       '--state', state_file, '--append')
+        if appended is None:
+            failures.append('--append of the {} failed'.format(name))
+            continue
+        report.update(report_by_key(appended))
+
+    if report != full:
+        failures.append('--append: {} of {} report rows differ from a full run'.format(
+            sum(full.get(key) != report.get(key) for key in set(full) | set(report)),
+            len(full)))
+
+    with open(state_file, mode='rb') as saved_state:
+        state = saved_state.read()
+    if run('border_crossing_statistics.py', new_month, output_file,
+           '--state', state_file, '--append') is not None:
+        failures.append('--append of a month already in the state did not fail')
+    with open(state_file, mode='rb') as saved_state:
+        if saved_state.read() != state:
+            failures.append('a rejected --append changed the state file')
+    return failures
+
+
+def check_warehouse(parts, tmp_dir):
+    """Checks --db against full runs of the rows ingested so far.
+
+    Returns:
+        failures (list): what did not match
+    """
+
+    output_file = os.path.join(tmp_dir, 'sql_report.csv')
+    ingested_file = os.path.join(tmp_dir, 'ingested.csv')
+    db = os.path.join(tmp_dir, 'warehouse.sqlite')
+
+    failures, ingested = [], []
+    for name, part in zip(('history', 'new month', 'backfill', 'new month again'),
+                          parts + parts[1:2]):
+        header, rows = read_csv(part)
+        if name != 'new month again':
+            ingested.extend(rows)
+        write_csv(ingested_file, header, ingested)
+
+        full = run('SQL_border_crossing_statistics.py', ingested_file, output_file)
+        report = run('SQL_border_crossing_statistics.py', part, output_file, '--db', db)
+        if report is None:
+            failures.append('--db of the {} failed'.format(name))
+        elif report != full:
+            failures.append('--db: the report after the {} differs from a full run'.format(name))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the incremental runs against full runs')
+    parser.add_argument('--input', help="input file to split by month",
+                        default=os.path.join(PROJECT_PATH, 'input',
+                                             'Border_Crossing_Entry_Data_SQL_test.csv'))
+    args = parser.parse_args()
+    input_file = os.path.abspath(args.input)
+
+    failures = dict()
+    with tempfile.TemporaryDirectory(prefix='bcs-incremental-') as tmp_dir:
+        parts = split_by_month(input_file, tmp_dir)
+        failures['state_append'] = check_state(input_file, parts, tmp_dir)
+        failures['sql_warehouse'] = check_warehouse(parts, tmp_dir)
+
+    for test, test_failures in failures.items():
+        for failure in test_failures:
+            print('[FAIL]: {} ({})'.format(test, failure))
+        if not test_failures:
+            print('[PASS]: {}'.format(test))
+    sys.exit(1 if any(failures.values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""Checks the input and aggregation paths of the scripts against their default
+   path: every input of insight_testsuite/tests, and a synthetic input that
+   spans several 1 MB chunks, is run through each path below, and the report
+   has to be the same as a plain run of the same script on the plain input.
+
+       compressed   .gz, .bz2, .xz, and .zip inputs, with and without
+                    --decompress-thread (all three scripts)
+       pipeline     --pipeline in a thread and with --workers 2, of a plain
+                    and of a .gz input (both CSV scripts)
+       spilling     a 1K --memory-budget, with and without --stream (the
+                    external sort and SpillingTotals), and in the optimized
+                    script (SpillingTotals)
+
+   BackgroundReader is also checked on its own, with chunks small enough that
+   a read spans several of them, and so is that the 1K budget does spill
+   every input to temporary files.
+
+   Usage: python3 insight_testsuite/run_input_path_tests.py [--rows 20000]
+"""
+
+import argparse
+import bz2
+import gzip
+import io
+import lzma
+import os
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+from glob import glob
+
+PROJECT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(PROJECT_PATH, 'src')
+sys.path.insert(0, SRC)
+sys.path.insert(0, PROJECT_PATH)
+
+import external_sort  # noqa: E402
+from utils import input_records  # noqa: E402
+from compression import BackgroundReader  # noqa: E402
+from benchmarks.synthetic import write_synthetic_csv  # noqa: E402
+
+SCRIPTS = ['border_crossing_statistics.py', 'border_crossing_statistics_optimized.py',
+           'SQL_border_crossing_statistics.py']
+
+CSV_SCRIPTS = SCRIPTS[:2]
+
+# (path, script, suffix the input is compressed to (None if it is not),
+# flags), each checked against the script's report of the plain input
+# without any flags
+CASES = [('compressed {}{}'.format(suffix, ' --decompress-thread' if flags else ''),
+          script, suffix, flags)
+         for script in SCRIPTS
+         for suffix in ('.gz', '.bz2', '.xz', '.zip')
+         for flags in ([], ['--decompress-thread'])]
+
+# The synthetic input spans several chunks of the pipeline, so rows are
+# split across chunk boundaries
+CASES += [(' '.join(['pipeline'] + [suffix] * bool(suffix) + flags), script, suffix,
+           ['--pipeline'] + flags)
+          for script in CSV_SCRIPTS
+          for suffix in (None, '.gz')
+          for flags in ([], ['--workers', '2'])]
+
+# A budget small enough that even the inputs of a few rows are spilled (see
+# check_spilling)
+MEMORY_BUDGET = '1K'
+CASES += [(' '.join(['spilling'] + flags), script, None, flags + ['--memory-budget',
+                                                                  MEMORY_BUDGET])
+          for script, flags in (('border_crossing_statistics.py', []),
+                                ('border_crossing_statistics.py', ['--stream']),
+                                ('border_crossing_statistics_optimized.py', []))]
+
+
+def compress(filename, suffix):
+    """Writes a compressed copy of the file (a .zip holds the file itself).
+
+    Returns:
+        compressed (str): name of the compressed file
+    """
+    compressed = filename + suffix
+    if suffix == '.zip':
+        with zipfile.ZipFile(compressed, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.write(filename, arcname=os.path.basename(filename))
+        return compressed
+
+    open_compressed = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}[suffix]
+    with open(filename, mode='rb') as infile, \
+            open_compressed(compressed, mode='wb') as outfile:
+        outfile.write(infile.read())
+    return compressed
+
+
+def run(script, input_file, output_file, flags):
+    """Runs a script.
+
+    Returns:
+        report (bytes): the output file (None if the script failed)
+        error (str): the last line the script wrote to stderr
+    """
+    process = subprocess.run([sys.executable, os.path.join(SRC, script), '--input',
+                              input_file, '--output', output_file] + flags,
+                             capture_output=True, text=True)
+    if process.returncode:
+        return None, (process.stderr.strip().splitlines() or [''])[-1]
+    with open(output_file, mode='rb') as report:
+        return report.read(), ''
+
+
+def test_inputs(tmp_dir, rows):
+    """Copies the inputs of the test suite, and writes the synthetic input.
+
+    Returns:
+        inputs (dict): {name: filename}
+    """
+    inputs = dict()
+    for filename in sorted(glob(os.path.join(PROJECT_PATH, 'insight_testsuite', 'tests',
+                                             '*', 'input', '*.csv'))):
+        name = filename.split(os.sep)[-3]
+        inputs[name] = os.path.join(tmp_dir, name + '.csv')
+        with open(filename, mode='rb') as infile, open(inputs[name], mode='wb') as outfile:
+            outfile.write(infile.read())
+
+    inputs['synthetic'] = os.path.join(tmp_dir, 'synthetic.csv')
+    write_synthetic_csv(inputs['synthetic'], rows, num_ports=40, sparsity=0.1,
+                        duplicates=0.05)
+    return inputs
+
+
+def check_paths(inputs, tmp_dir):
+    """Runs every input through every case, and diffs the reports. An input
+       the default path of a script fails on (my_test_1 has no header, which
+       the optimized script reads its columns by) is skipped for that script.
+
+    Returns:
+        failures (list): the cases whose reports differ (or that failed)
+        skipped (list): the inputs skipped for a script
+    """
+
+    output_file = os.path.join(tmp_dir, 'report.csv')
+    failures, skipped = [], []
+    for name, input_file in inputs.items():
+        expected, compressed = dict(), dict()
+        for path, script, suffix, flags in CASES:
+            if script not in expected:
+                expected[script], error = run(script, input_file, output_file, [])
+                if expected[script] is None:
+                    skipped.append('{} of {}: {}'.format(script, name, error))
+            if expected[script] is None:
+                continue
+            if suffix and suffix not in compressed:
+                compressed[suffix] = compress(input_file, suffix)
+
+            report, error = run(script, compressed.get(suffix, input_file), output_file,
+                                flags)
+            if report != expected[script]:
+                failures.append('{} of {} with {}{}'.format(
+                    script, name, path, ': ' + error if error else ''))
+    return failures, skipped
+
+
+class FailingStream(io.BytesIO):
+    """Stream that fails once its first bytes were read."""
+
+    def read(self, size=-1):
+        if self.tell():
+            raise OSError('the stream broke')
+        return super().read(size)
+
+
+def check_background_reader(data):
+    """Reads the data back through a BackgroundReader in small chunks.
+
+    Returns:
+        failures (list): what did not match
+    """
+
+    failures = []
+    with io.BufferedReader(BackgroundReader(io.BytesIO(data), chunk_size=4099,
+                                            queue_size=2)) as reader:
+        if reader.read() != data:
+            failures.append('the bytes read back differ')
+
+    with io.TextIOWrapper(io.BufferedReader(BackgroundReader(io.BytesIO(data),
+                                                             chunk_size=97)),
+                          encoding='utf-8', newline='') as reader:
+        if ''.join(reader) != data.decode('utf-8'):
+            failures.append('the lines read back differ')
+
+    # An error in the background thread is raised in the reader
+    try:
+        with io.BufferedReader(BackgroundReader(FailingStream(data), chunk_size=4099)) as reader:
+            reader.read()
+        failures.append('an error of the stream was not raised')
+    except OSError:
+        pass
+
+    # Closing it before the end stops the background thread
+    reader = BackgroundReader(io.BytesIO(data), chunk_size=97, queue_size=1)
+    reader.read(10)
+    reader.close()
+    if reader._thread.is_alive():
+        failures.append('the background thread outlived close()')
+    return failures
+
+
+def check_spilling(inputs):
+    """Checks that the memory budget of the spilling cases makes the external
+       sort write more than one run for every input, and SpillingTotals spill
+       the keys of every input that has more of them than the budget holds
+       (my_test_2 has only one crossing).
+
+    Returns:
+        failures (list): the inputs that fit in the memory budget
+    """
+
+    memory_budget = int(MEMORY_BUDGET[:-1]) * 1024
+    write_run = external_sort.write_run
+    failures = []
+    for name, input_file in inputs.items():
+        records = list(input_records(input_file))
+
+        runs = []
+        external_sort.write_run = lambda *args: runs.append(1) or write_run(*args)
+        try:
+            sorted_records = list(external_sort.external_sorted(
+                records, lambda record: record, memory_budget))
+        finally:
+            external_sort.write_run = write_run
+        if len(runs) < 2 or sorted_records != sorted(records):
+            failures.append('the external sort of {} wrote {} runs'.format(name, len(runs)))
+
+        totals = external_sort.SpillingTotals(memory_budget)
+        for border, date, measure, value in records:
+            totals.add(border, measure, date, value)
+        keys = len({(border, measure, date) for border, date, measure, _ in records})
+        if totals._buckets is None and keys > totals._max_keys:
+            failures.append('SpillingTotals kept the keys of {} in memory'.format(name))
+        list(totals.items())
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the input and aggregation paths')
+    parser.add_argument('--rows', help="rows of the synthetic input", type=int,
+                        default=20000)
+    args = parser.parse_args()
+
+    failures = dict()
+    with tempfile.TemporaryDirectory(prefix='bcs-input-paths-') as tmp_dir:
+        inputs = test_inputs(tmp_dir, args.rows)
+        with open(inputs['synthetic'], mode='rb') as synthetic:
+            failures['background_reader'] = check_background_reader(synthetic.read())
+        failures['spilling'] = check_spilling(inputs)
+        failures['input_paths'], skipped = check_paths(inputs, tmp_dir)
+
+    for skip in skipped:
+        print('[SKIP]: input_paths ({})'.format(skip))
+    for test, test_failures in failures.items():
+        for failure in test_failures:
+            print('[FAIL]: {} ({})'.format(test, failure))
+        if not test_failures:
+            print('[PASS]: {}'.format(test))
+    sys.exit(1 if any(failures.values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Checks the importable API (report.BorderCrossingReport) against the scripts:
+   every engine, given the input as a csv file, a list of mappings, and a list
+   of (Border, Date, Measure, Value) sequences, has to report the same rows as
+   the script it comes from writes to its output file.
+
+       sorted-groupby, nested-dict  border_crossing_statistics.py
+       sql                          SQL_border_crossing_statistics.py (which
+                                    breaks ties between borders the other way)
+
+   The input file is shuffled, so the rows of a crossing are not next to each
+   other, and some of its Values are emptied or made non-numeric, which the
+   scripts count as 0.
+
+   Usage: python3 insight_testsuite/run_report_api_tests.py
+                  [--input input/Border_Crossing_Entry_Data_SQL_test.csv]
+"""
+
+import argparse
+import csv
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+PROJECT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC = os.path.join(PROJECT_PATH, 'src')
+sys.path.insert(0, SRC)
+
+from report import BorderCrossingReport  # noqa: E402
+
+SCRIPTS = {'sorted-groupby': 'border_crossing_statistics.py',
+           'nested-dict': 'border_crossing_statistics.py',
+           'sql': 'SQL_border_crossing_statistics.py'}
+
+# Report options, with the command line flags of the scripts that match them
+OPTIONS = [({}, []),
+           ({'memory_budget': 2048}, []),
+           ({'borders': 'US-Canada Border', 'since': '2007-01', 'top': 5},
+            ['--border', 'US-Canada Border', '--since', '2007-01', '--top', '5'])]
+
+
+def write_test_input(filename, input_file, seed=0):
+    """Writes a shuffled copy of the input file, with some of its Values
+       emptied or made non-numeric."""
+    with open(input_file, mode='r', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        header = next(csv_reader)
+        rows = list(csv_reader)
+
+    rng = random.Random(seed)
+    rng.shuffle(rows)
+    value = header.index('Value')
+    for i, row in enumerate(rows[:6]):
+        row[value] = ('', ' ', 'n/a')[i % 3]
+
+    with open(filename, mode='w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',')
+        csv_writer.writerow(header)
+        csv_writer.writerows(rows)
+
+
+def script_report(script, input_file, output_file, flags):
+    """Returns the rows the script writes to its output file (without the header)."""
+    subprocess.run([sys.executable, os.path.join(SRC, script), '--input', input_file,
+                    '--output', output_file] + flags, check=True, capture_output=True)
+    with open(output_file, mode='r', newline='') as csv_file:
+        return list(csv.reader(csv_file, delimiter=','))[1:]
+
+
+def sources(input_file):
+    """Generator of (name, source) pairs: the input file as a text and a
+       binary file object, a list of mappings, and a list of sequences."""
+    with open(input_file, mode='r', newline='') as csv_file:
+        yield 'text file', csv_file
+    with open(input_file, mode='rb') as csv_file:
+        yield 'binary file', csv_file
+    with open(input_file, mode='r', newline='') as csv_file:
+        mappings = list(csv.DictReader(csv_file, delimiter=','))
+    yield 'mappings', mappings
+    yield 'sequences', [(row['Border'], row['Date'], row['Measure'], row['Value'])
+                        for row in mappings]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the report API against the scripts')
+    parser.add_argument('--input', help="input file to shuffle and run",
+                        default=os.path.join(PROJECT_PATH, 'input',
+                                             'Border_Crossing_Entry_Data_SQL_test.csv'))
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='bcs-report-api-') as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.csv')
+        output_file = os.path.join(tmp_dir, 'report.csv')
+        write_test_input(input_file, os.path.abspath(args.input))
+
+        for engine, script in SCRIPTS.items():
+            for options, flags in OPTIONS:
+                if engine == 'sql' and 'memory_budget' in options:
+                    continue
+                expected = script_report(script, input_file, output_file, flags)
+                for name, source in sources(input_file):
+                    rows = [[str(field) for field in row] for row in
+                            BorderCrossingReport(source, engine=engine, **options)]
+                    if rows != expected:
+                        failures.append('{} of {} {}: {} rows, {} expected'.format(
+                            engine, name, options, len(rows), len(expected)))
+
+    for failure in failures:
+        print('[FAIL]: report_api ({})'.format(failure))
+    if not failures:
+        print('[PASS]: report_api')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""Checks the prefix sum index (series_index.SeriesIndex) and the report server
+   (serve.py) on a synthetic input file whose series have gaps in them:
+
+       index   rows, summaries of random ranges of months, and the trailing
+               averages and year over year deltas of every month, against
+               sums of the months added up one by one
+       server  /series, /summary, and /rows against the same sums, 404 for an
+               unknown series or path, 400 for a query that is missing a
+               parameter or has a bad month, and a reload of the index once
+               the input file changes
+
+   Usage: python3 insight_testsuite/run_serve_tests.py [--years 3] [--seed 0]
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+PROJECT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(PROJECT_PATH, 'src'))
+sys.path.insert(0, PROJECT_PATH)
+
+from utils import DateIndex, my_round  # noqa: E402
+from series_index import SeriesIndex  # noqa: E402
+from serve import ReportServer, ReportRequestHandler  # noqa: E402
+from benchmarks.synthetic import write_synthetic_csv  # noqa: E402
+
+WINDOWS = (1, 3, 12)
+
+
+class QuietRequestHandler(ReportRequestHandler):
+    """Answers the requests without logging each of them to stderr."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def brute_force_series(filename):
+    """Adds up the input file one row at a time.
+
+    Returns:
+        series (dict): {(border, measure): {ordinal month: (date, sum)}}
+    """
+    date_index = DateIndex()
+    series = dict()
+    with open(filename, mode='r', newline='') as csv_file:
+        for row in csv.DictReader(csv_file, delimiter=','):
+            months = series.setdefault((row['Border'], row['Measure']), {})
+            month = date_index[row['Date']]
+            date, total = months.get(month, (row['Date'], 0))
+            months[month] = (date, total + int(row['Value']))
+    return series
+
+
+def brute_force_rows(border, measure, months, since=None, until=None):
+    """The report rows of a series between since and until, most recent first."""
+    rows, earlier = [], []
+    for month in sorted(months):
+        date, value = months[month]
+        if (since is None or month >= since) and (until is None or month <= until):
+            rows.append((border, date, measure, value,
+                         my_round(sum(earlier) / len(earlier)) if earlier else 0))
+        earlier.append(value)
+    return rows[::-1]
+
+
+def brute_force_summary(border, measure, months, since, until):
+    """The summary of a series between since and until (see SeriesIndex.summary)."""
+    in_range = [month for month in sorted(months) if since <= month <= until]
+    values = [months[month][1] for month in in_range]
+    earlier = ([months[month][1] for month in months if month < in_range[-1]]
+               if in_range else [])
+    return {'border': border, 'measure': measure,
+            'first': months[in_range[0]][0] if in_range else None,
+            'last': months[in_range[-1]][0] if in_range else None,
+            'months': len(values), 'total': sum(values),
+            'average': my_round(sum(values) / len(values)) if values else 0,
+            'running_average': my_round(sum(earlier) / len(earlier)) if earlier else 0}
+
+
+def brute_force_windows(months, month):
+    """The trailing averages and year over year delta of a month (see
+       SeriesIndex.window_columns)."""
+    columns = []
+    for window in WINDOWS:
+        values = [months[earlier][1] for earlier in range(month - window, month)
+                  if earlier in months]
+        columns.append(my_round(sum(values) / len(values)) if values else 0)
+    last_year = months.get(month - 12)
+    columns.append(months[month][1] - last_year[1] if last_year else None)
+    return columns
+
+
+def check_index(index, series, rng):
+    """Checks the index against the brute force sums.
+
+    Returns:
+        failures (list): what did not match
+    """
+
+    failures = []
+    if index.keys() != sorted(series):
+        failures.append('keys() differs')
+
+    for (border, measure), months in sorted(series.items()):
+        if index.rows(border, measure) != brute_force_rows(border, measure, months):
+            failures.append('rows() of {}, {}'.format(border, measure))
+
+        for month in months:
+            if index.window_columns(border, measure, month, WINDOWS) != \
+                    brute_force_windows(months, month):
+                failures.append('window_columns() of {}, {}, {}'.format(border, measure,
+                                                                        month))
+
+        # Random ranges, some of which start or end between the months of
+        # the series, or have no months in them at all
+        first, last = min(months), max(months)
+        for _ in range(20):
+            since, until = sorted(rng.randint(first - 3, last + 3) for _ in range(2))
+            if index.summary(border, measure, since, until) != \
+                    brute_force_summary(border, measure, months, since, until):
+                failures.append('summary() of {}, {}, {}-{}'.format(border, measure,
+                                                                    since, until))
+    return failures
+
+
+def get(server, path, **query):
+    """Sends a GET request to the server.
+
+    Returns:
+        status (int): the HTTP status of the response
+        body: the JSON body of the response
+    """
+    host, port = server.server_address[:2]
+    url = 'http://{}:{}{}?{}'.format(host, port, path, urlencode(query))
+    try:
+        with urlopen(url, timeout=10) as response:
+            return response.status, json.load(response)
+    except HTTPError as error:
+        return error.code, json.load(error)
+
+
+def month_text(month):
+    """Turns an ordinal month back into YYYY-MM."""
+    return '{}-{:02d}'.format(month // 12, month % 12 + 1)
+
+
+def check_server(server, series, rng):
+    """Checks the endpoints of the server against the brute force sums.
+
+    Returns:
+        failures (list): what did not match
+    """
+
+    failures = []
+    status, body = get(server, '/series')
+    if status != 200 or body != [{'border': border, 'measure': measure}
+                                 for border, measure in sorted(series)]:
+        failures.append('/series ({})'.format(status))
+
+    for (border, measure), months in sorted(series.items()):
+        since, until = sorted(rng.sample(sorted(months), 2))
+        query = {'border': border, 'measure': measure, 'since': month_text(since),
+                 'until': month_text(until)}
+
+        status, body = get(server, '/summary', **query)
+        if status != 200 or body != brute_force_summary(border, measure, months,
+                                                        since, until):
+            failures.append('/summary of {}, {} ({})'.format(border, measure, status))
+
+        status, body = get(server, '/rows', **query)
+        expected = [dict(zip(('border', 'date', 'measure', 'value', 'average'), row))
+                    for row in brute_force_rows(border, measure, months, since, until)]
+        if status != 200 or body != expected:
+            failures.append('/rows of {}, {} ({})'.format(border, measure, status))
+
+    border, measure = sorted(series)[0]
+    for path, query, expected_status in (
+            ('/summary', {'border': 'Nowhere', 'measure': measure}, 404),
+            ('/rows', {'border': border, 'measure': 'Nothing'}, 404),
+            ('/totals', {'border': border, 'measure': measure}, 404),
+            ('/summary', {'border': border}, 400),
+            ('/rows', {'measure': measure}, 400),
+            ('/summary', {'border': border, 'measure': measure, 'since': '2019-13'}, 400),
+            ('/rows', {'border': border, 'measure': measure, 'until': 'March'}, 400)):
+        status, body = get(server, path, **query)
+        if status != expected_status or 'error' not in body:
+            failures.append('{} {} gave {}, not {}'.format(path, query, status,
+                                                           expected_status))
+    return failures
+
+
+def check_reload(server, filename, series):
+    """Adds a month to a series in the input file, and checks that the server
+       reloads its index and answers with the new month.
+
+    Returns:
+        failures (list): what did not match
+    """
+
+    (border, measure), months = sorted(series.items())[0]
+    month = max(months) + 1
+    date = '{:02d}/01/{} 12:00:00 AM'.format(month % 12 + 1, month // 12)
+    with open(filename, mode='a', newline='') as csv_file:
+        csv.writer(csv_file).writerow(['Port 0', 'State', '100', border, date, measure,
+                                       '12345', 'POINT (-70.00000 45.00000)'])
+
+    old_index = server.index
+    status, body = get(server, '/summary', border=border, measure=measure)
+    failures = []
+    if server.index is old_index:
+        failures.append('the index was not reloaded')
+    if status != 200 or body['last'] != date or \
+            body['total'] != sum(value for _, value in months.values()) + 12345:
+        failures.append('/summary after the reload ({}, {})'.format(status, body))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the series index and the report server')
+    parser.add_argument('--years', help="years of synthetic data", type=int, default=3)
+    parser.add_argument('--seed', help="seed of the synthetic data and the ranges",
+                        type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    failures = dict()
+    with tempfile.TemporaryDirectory(prefix='bcs-serve-') as tmp_dir:
+
+        # Ports skip some of the months, so the series have gaps in them
+        filename = os.path.join(tmp_dir, 'input.csv')
+        write_synthetic_csv(filename, num_ports=6, seed=args.seed,
+                            measures=['Pedestrians', 'Trains', 'Trucks'],
+                            years=args.years, sparsity=0.5)
+        series = brute_force_series(filename)
+
+        index = SeriesIndex.load(filename)
+        failures['series_index'] = check_index(index, series, rng)
+
+        server = ReportServer(('127.0.0.1', 0), index)
+        server.RequestHandlerClass = QuietRequestHandler
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            failures['serve'] = check_server(server, series, rng)
+            failures['serve_reload'] = check_reload(server, filename, series)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    for test, test_failures in failures.items():
+        for failure in test_failures:
+            print('[FAIL]: {} ({})'.format(test, failure))
+        if not test_failures:
+            print('[PASS]: {}'.format(test))
+    sys.exit(1 if any(failures.values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
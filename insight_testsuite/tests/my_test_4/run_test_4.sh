@@ -0,0 +1,5 @@
+#!/bin/bash
+#
+# Use this shell script to compile (if necessary) your code and then execute it. Belw is an example of what might be found in this file if your program was written in Python 3.7
+python3 src/border_crossing_statistics.py --input input/Border_Crossing_Entry_Data_test_out_of_order.csv --output output/report_test_out_of_order.csv
+# python3.7 ./src/border_analytics.py ./input/Border_Crossing_Entry_data.csv ./output/report.csv
@@ -1,11 +1,19 @@
 """This script performs the same operation as in border_crossing_statistics, except
  it uses SQL."""
 
-import csv
-import sqlalchemy as db
+import sqlite3
 
-from utils import convert_date_to_sql, convert_date_back_to_original_format, \
-    parse_args
+from utils import parse_args, check_flags, input_records, DateIndex, write_to_csv
+from utils import csv_port_records, RecordFilter
+from sql_engine import load_bct_table, restore_dates, report_query
+from sql_engine import ingest_into_warehouse, warehouse_report
+from sql_engine import CREATE_CROSSINGS_TABLE, CREATE_CROSSINGS_INDEX
+from profiler import Profiler
+
+# The flags of utils.parse_args this script supports (the others are rejected)
+SUPPORTED_FLAGS = {'input', 'output', 'mmap', 'cache', 'db', 'border', 'measure', 'since',
+                   'until', 'top', 'decompress_thread', 'windows', 'profile',
+                   'profile_memory', 'profile_dir', 'metrics'}
 
 
 def main():
@@ -18,53 +26,68 @@ def main():
         raise ImportError('Did not specify the correct input file!')
     if args.output is None:
         raise ImportError('Did not specify the correct output file!')
-
-    engine = db.create_engine('sqlite://', echo=False)
-
-    df = convert_date_to_sql(args.input)
-
-    df.to_sql("bct", con=engine, if_exists='fail', index=False)
-
-    # The first subquery gets the Border, Date, Measure, and Total Sum Value
-    # From that subquery, we are going to select the measure and where the
-    # (current) date is > than the previous, and create a average cumulative sum
-    # -- we make sure to round if there is nothing (hence, starts the average)
-
-    # Write out to the output csv file:
-    with open(args.output, mode='w') as csv_outfile:
-
-        outfile_writer = csv.writer(csv_outfile, delimiter=',', quotechar='"',
-                                    quoting=csv.QUOTE_NONE)
-
-        # Column headers--Don't quote them
-        outfile_writer.writerow(['Border', 'Date', 'Measure', 'Value', 'Average'])
-
-        for row in engine.execute("WITH crossings as ("
-                                    "SELECT Border, Date, Measure, SUM(VALUE) "
-                                  "as SumField "
-                                    "FROM bct "
-                                    "GROUP BY Border, Date, Measure "
-                                    "ORDER BY Date DESC, SumField DESC, "
-                                  "Measure DESC, Border DESC"
-                                  ") "
-                                  "SELECT Border, Date, Measure, SumField,"
-                                  "ifnull((SELECT cast(round(avg(c2.SumField),"
-                                  " 0) AS INTEGER) "
-                                            "FROM crossings AS c2 "
-                                            "WHERE c2.Border = c.Border "
-                                                "AND c2.Measure = c.Measure "
-                                                "AND c2.Date < c.Date),0) AS Average "
-                                  "FROM crossings AS c "
-                                    "ORDER BY Date DESC, SumField DESC, Border,"
-                                  " Measure DESC;"):
-
-            outfile_writer = csv.writer(csv_outfile, delimiter=',', quotechar='"',
-                                        quoting=csv.QUOTE_MINIMAL)
-
-            # for each row in the final list, remove the list of list and create one list
-            outfile_writer.writerow(row)
-
-    convert_date_back_to_original_format(args.output)
+    if args.state or args.append:
+        raise ImportError('The SQL script keeps its history in a warehouse (--db), '
+                          'not an aggregate state!')
+    check_flags(args, 'SQL_border_crossing_statistics.py', SUPPORTED_FLAGS)
+    if args.db and (args.mmap or args.cache):
+        raise ImportError('The warehouse reads only the new rows of the csv file itself!')
+    if args.db and args.windows:
+        raise ImportError('The warehouse does not keep trailing averages!')
+
+    # Skip the rows of the borders, measures, and months that are not asked
+    # for while reading (the months before --since are still needed for the
+    # running averages, so those are dropped from the report only)
+    record_filter = RecordFilter(args.border, args.measure, args.until)
+
+    # Time (and count the rows and allocations of) each phase, if asked to
+    profiler = Profiler.from_args('SQL_border_crossing_statistics', args)
+
+    if args.db:
+
+        # Add only the new rows to the on-disk warehouse, and update only the
+        # crossings they change, then read the report out of it
+        connection = sqlite3.connect(args.db)
+        with profiler.phase('ingest'):
+            ingest_into_warehouse(connection, profiler.counted(
+                'input_rows', csv_port_records(args.input, args.decompress_thread)),
+                DateIndex())
+        with profiler.phase('report_and_write'):
+            write_to_csv(args.output, profiler.counted(
+                'report_rows', warehouse_report(connection, record_filter,
+                                                args.since, args.top)))
+        connection.close()
+        profiler.finish()
+        return
+
+    connection = sqlite3.connect(':memory:')
+
+    # Stream the records straight into SQLite, with the dates as
+    # (sortable) ordinal month numbers
+    date_index = DateIndex()
+    with profiler.phase('load'):
+        load_bct_table(connection, record_filter(profiler.counted(
+            'input_rows', input_records(args.input, args.mmap, args.cache,
+                                        args.decompress_thread))), date_index)
+
+    # Aggregate the Total Sum Value of each Border, Date, and Measure into
+    # its own (indexed) table. Then the average of the previous months is a
+    # window over each Border and Measure ordered by Date, which reads every
+    # row once instead of once per later month (the old correlated subquery)
+    with profiler.phase('aggregate'):
+        connection.execute(CREATE_CROSSINGS_TABLE)
+        connection.execute(CREATE_CROSSINGS_INDEX)
+
+    # Write out to the output csv file, with the original date strings (the
+    # rows are averaged and sorted as they are read out of the query)
+    query, parameters = report_query(args.since, args.top, args.windows)
+    with profiler.phase('report_and_write'):
+        write_to_csv(args.output, profiler.counted(
+            'report_rows', restore_dates(connection.execute(query, parameters),
+                                         date_index)), args.windows)
+
+    connection.close()
+    profiler.finish()
 
 
 if __name__ == "__main__":
@@ -3,15 +3,99 @@
     Date, Value, Measure, and Border."""
 
 # Necessary packages
-import csv
-
 from operator import itemgetter
-from datetime import datetime
 from itertools import groupby
 
 # import helper functions from util file
-from utils import count_the_months, check_all_there, parse_args
-from utils import calculate_average_crossing_per_month_and_measure, write_to_csv
+from utils import check_all_there, parse_args, check_flags, aggregate_crossings
+from utils import aggregate_crossings_in_parallel, input_records
+from utils import DateIndex, calculate_running_average, write_to_csv, ReportState
+from utils import series_running_average
+from utils import RecordFilter, sort_report
+from profiler import Profiler
+
+# The flags of utils.parse_args this script supports (the others are rejected)
+SUPPORTED_FLAGS = {'input', 'output', 'stream', 'workers', 'mmap', 'cache', 'engine',
+                   'state', 'append', 'border', 'measure', 'since', 'until', 'top',
+                   'pipeline', 'decompress_thread', 'windows', 'profile',
+                   'profile_memory', 'profile_dir', 'metrics', 'memory_budget'}
+
+
+def read_and_aggregate(records, stream=False, memory_budget=None):
+    """Aggregates the values of each border name, date, and measure.
+
+    Args:
+        records: iterable of (Border, Date, Measure, Value) records
+        stream: if True, aggregate the rows one at a time instead of
+                sorting and grouping the whole file
+        memory_budget: if given, the bytes of rows to sort (or, if stream is
+                       True, of keys to aggregate) in memory at a time, past
+                       which they are spilled to temporary files
+
+    Returns:
+        list_with_agg_values (list): the list with Border, Date, Measure,
+                                     and aggregated values (an iterator of
+                                     them in (Border, Measure, Date) order,
+                                     if stream and memory_budget are given).
+    """
+
+    if stream and memory_budget is not None:
+
+        # Only imported when it is asked for, since tempfile is slow to import
+        from external_sort import SpillingTotals
+
+        # Aggregate the values row by row, spilling the keys by their hash to
+        # bucket files once they take up the memory budget, then read the
+        # sums back bucket by bucket in (Border, Measure, Date) order
+        totals = SpillingTotals(memory_budget)
+        for border, date, measure, value in records:
+            totals.add(border, measure, date, value)
+        list_with_agg_values = ([border, date, measure, value]
+                                for (border, measure, date), value in totals.items())
+    elif stream:
+
+        # Aggregate the values row by row without keeping the rows around
+        totals = aggregate_crossings(records)
+        list_with_agg_values = [list(key) + [value] for key, value in totals.items()]
+
+        # Make sure the aggregated rows are not empty
+        if check_all_there(list_with_agg_values):
+            pass
+    elif memory_budget is not None:
+
+        # Only imported when it is asked for, since tempfile is slow to import
+        from external_sort import external_sorted
+
+        # Sort chunks of the rows that fit in the memory budget, spill them to
+        # temporary run files, and merge the runs back into one stream of rows
+        # sorted by Border, Date, and Measure, which is grouped as it is read
+        sorted_records = external_sorted(records, itemgetter(0, 1, 2), memory_budget)
+        list_with_agg_values = [list(key) + [sum(r[3] for r in rows)]
+                                for key, rows in groupby(sorted_records,
+                                                         key=itemgetter(0, 1, 2))]
+
+        # Make sure the aggregated rows are not empty
+        if check_all_there(list_with_agg_values):
+            pass
+    else:
+        # Sort the list by Border, Date, and Measure, so all the rows of a
+        # crossing are next to each other wherever they are in the input
+        sorted_list = sorted(records, key=itemgetter(0, 1, 2))
+
+        # Make sure the sorted_list rows are not empty
+        if check_all_there(sorted_list):
+            pass
+
+        # Let's group the sorted list via the keys--border names, dates,
+        # and measures, so that there are rows with the same border name, date,
+        # measure, but different values! Then add those values together
+        # and create a new list, which holds this aggregated summation of
+        # values for each border name, date, and measure
+        list_with_agg_values = [list(key) + [sum(r[3] for r in rows)]
+                                for key, rows in groupby(sorted_list,
+                                                         key=itemgetter(0, 1, 2))]
+
+    return list_with_agg_values
 
 
 def main():
@@ -24,47 +108,155 @@ def main():
         raise ImportError('Did not specify the correct input file!')
     if args.output is None:
         raise ImportError('Did not specify the correct output file!')
+    check_flags(args, 'border_crossing_statistics.py', SUPPORTED_FLAGS)
+    if args.append and args.state is None:
+        raise ImportError('Did not specify the state file to append to!')
+    if args.engine == 'numpy' and args.state:
+        raise ImportError('The numpy engine does not keep an aggregate state!')
+    if args.windows and (args.engine == 'numpy' or args.append):
+        raise ImportError('Cannot add trailing averages with the numpy engine or --append!')
+    if args.pipeline and (args.engine == 'numpy' or args.mmap or args.cache):
+        raise ImportError('The pipeline reads the csv file itself!')
+    if args.memory_budget and (args.engine == 'numpy' or args.pipeline or args.workers > 1):
+        raise ImportError('The memory budget only applies to the groupby and streaming engines!')
+    if args.memory_budget and args.stream and (args.state or args.windows):
+        raise ImportError('Cannot keep an aggregate state or add trailing averages of '
+                          'spilled keys!')
 
-    # Read in the border_crossing data
-    with open(args.input, mode='r') as csv_file:
+    # Skip the rows of the borders, measures, and months that are not asked
+    # for while reading (the months before --since are still needed for the
+    # running averages, so those are dropped from the report only)
+    record_filter = RecordFilter(args.border, args.measure, args.until)
+    if record_filter and args.state:
+        raise ImportError('Cannot keep an aggregate state of filtered rows!')
 
-        # Read the CSV data into a list of lists
-        csv_reader = csv.reader(csv_file, delimiter=',')
+    # Time (and count the rows and allocations of) each phase, if asked to
+    profiler = Profiler.from_args('border_crossing_statistics', args)
 
-        # Sort the list by Border, Date, and Measure in descending order
-        sorted_list = sorted(csv_reader, key=itemgetter(3, 5))
+    if args.engine == 'numpy':
 
-        # Make sure the sorted_list rows are not empty
-        if check_all_there(sorted_list):
+        # Only imported when it is asked for, since NumPy is optional
+        from numpy_engine import encode_records, load_cached_columns, numpy_report
+
+        with profiler.phase('parse'):
+            if args.cache:
+                dictionaries, columns = load_cached_columns(args.input, record_filter)
+            elif args.workers > 1:
+                totals = aggregate_crossings_in_parallel(args.input, args.workers,
+                                                         record_filter)
+                dictionaries, columns = encode_records(key + (value,)
+                                                       for key, value in totals.items())
+            else:
+                dictionaries, columns = encode_records(
+                    record_filter(input_records(args.input, args.mmap,
+                                                background=args.decompress_thread)))
+        profiler.count('input_rows', len(columns[3]))
+
+        with profiler.phase('report'):
+            final_sorted_list = numpy_report(dictionaries, columns, args.since, args.top)
+        with profiler.phase('write'):
+            write_to_csv(args.output, final_sorted_list)
+        profiler.count('report_rows', len(final_sorted_list))
+        profiler.finish()
+        return
+
+    if args.pipeline:
+
+        # Only imported when it is asked for, since asyncio is slow to import
+        import asyncio
+        from pipeline import aggregate_pipeline, write_pipeline
+
+        # Read the input file while the chunks already read are parsed and
+        # aggregated (in worker processes if there is more than one)
+        with profiler.phase('aggregate'):
+            totals = asyncio.run(aggregate_pipeline(args.input, args.workers,
+                                                    record_filter))
+        list_with_agg_values = [list(key) + [value] for key, value in totals.items()]
+
+        # Make sure the aggregated rows are not empty
+        if check_all_there(list_with_agg_values):
             pass
+    elif args.workers > 1 and not args.cache:
 
-        # Let's group the sorted list via the keys--border names, dates,
-        # and measures, so that there are rows with the same border name, date,
-        # measure, but different values! In each row, check if the
-        # 6th index (this is our value) is a number and is not 0! If true, then
-        # add those values together and create a new list, which holds this aggregated
-        # summation of values for each border name, date, and measure
-        list_with_agg_values = [key +
-                                [sum([int(r[6]) for r in rows if r[6].isdigit()
-                                      and int(r[6]) != 0])]
-                                for key, rows in groupby(sorted_list,
-                                                         key=lambda x: x[3:6])]
-
-        # x number of months -- could be a dictionary or int
-        num_of_months = count_the_months(list_with_agg_values)
-
-        # calculate the average crossing per month and per measure
-        list_with_avg = calculate_average_crossing_per_month_and_measure(num_of_months,
-                                                                         list_with_agg_values)
-
-        # Sort the list by Date, Value, Measure, Border in descending order
-        sorted_list_with_vbm = sorted(list_with_avg, key=itemgetter(3, 2, 0),
-                                      reverse=True)
-        final_sorted_list = sorted(sorted_list_with_vbm,
-                                   key=lambda x: datetime.strptime(x[1],
-                                                                   '%d/%m/%Y %H:%M:%S %p'),
-                                   reverse=True)
-    write_to_csv(args.output, final_sorted_list)
+        # Parse and aggregate line aligned byte ranges of the input file in
+        # separate processes, then merge the partial sums together
+        with profiler.phase('aggregate'):
+            totals = aggregate_crossings_in_parallel(args.input, args.workers,
+                                                     record_filter)
+        list_with_agg_values = [list(key) + [value] for key, value in totals.items()]
+
+        # Make sure the aggregated rows are not empty
+        if check_all_there(list_with_agg_values):
+            pass
+    else:
+        # Read in the border_crossing data (only the Border, Date, Measure,
+        # and Value columns)
+        records = profiler.counted('input_rows', record_filter(
+            input_records(args.input, args.mmap, args.cache, args.decompress_thread)))
+
+        # Parse all the rows first when profiling, so parsing and the groupby
+        # are timed apart (when streaming, or sorting through temporary files,
+        # the aggregate phase parses too)
+        if profiler.enabled and not args.stream and not args.memory_budget:
+            with profiler.phase('parse'):
+                records = list(records)
+        with profiler.phase('aggregate'):
+            list_with_agg_values = read_and_aggregate(records, args.stream,
+                                                      args.memory_budget)
+
+    # The spilled keys are only aggregated (and then averaged, sorted, and
+    # written) as they are read back, all in the write phase
+    spilled = args.stream and args.memory_budget
+    if spilled:
+        list_with_agg_values = profiler.counted('aggregated_rows', list_with_agg_values)
+    else:
+        profiler.count('aggregated_rows', len(list_with_agg_values))
+
+    # calculate the average crossing per month and per measure
+    date_index = DateIndex()
+    with profiler.phase('average'):
+        if args.state:
+
+            # Carry on from the state the earlier runs left behind (if
+            # appending), so only the report rows the input file changes are
+            # calculated
+            state = ReportState.load(args.state) if args.append else ReportState()
+            list_with_avg = state.update(list_with_agg_values, date_index)
+            state.save(args.state)
+        elif spilled:
+
+            # The spilled sums come back in (Border, Measure, Date) order, so
+            # each series is averaged as it goes by
+            list_with_avg = series_running_average(list_with_agg_values)
+        else:
+            list_with_avg = calculate_running_average(list_with_agg_values, date_index)
+
+    # Sort the list by Date, Value, Measure, Border in descending order
+    with profiler.phase('sort'):
+        final_sorted_list = sort_report(list_with_avg, date_index, args.since, args.top,
+                                        args.memory_budget)
+
+    # Add the trailing averages of the reported rows out of a prefix sum
+    # index of every aggregated row
+    if args.windows:
+        from series_index import SeriesIndex, add_window_columns
+        with profiler.phase('windows'):
+            final_sorted_list = add_window_columns(
+                final_sorted_list, SeriesIndex.from_rows(list_with_agg_values),
+                args.windows, date_index)
+
+    # The rows sorted through temporary files are merged as they are written
+    if args.memory_budget and args.top is None:
+        final_sorted_list = profiler.counted('report_rows', final_sorted_list)
+    else:
+        profiler.count('report_rows', len(final_sorted_list))
+
+    with profiler.phase('write'):
+        if args.pipeline:
+            asyncio.run(write_pipeline(args.output, final_sorted_list, args.windows))
+        else:
+            write_to_csv(args.output, final_sorted_list, args.windows)
+    profiler.finish()
 
 
 if __name__ == '__main__':
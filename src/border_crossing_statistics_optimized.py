@@ -1,10 +1,18 @@
 """ This script performs border crossing statistics via an optimized method
-    of Nested Dictionaries. The output csv file is ordered by
-    Date, Value, Measure, and Border."""
+    of a flat store of sums keyed by Border, Measure, and Date. The output csv
+    file is ordered by Date, Value, Measure, and Border."""
 
 import csv
 
-from utils import NestedDict, find_average, write_to_csv, parse_args
+from utils import write_to_csv, parse_args, check_flags, DateIndex, open_input, parse_value
+from utils import aggregate_crossings_in_parallel, input_records, RecordFilter
+from optimized_engine import CrossingTotals, find_average
+from profiler import Profiler
+
+# The flags of utils.parse_args this script supports (the others are rejected)
+SUPPORTED_FLAGS = {'input', 'output', 'workers', 'mmap', 'cache', 'border', 'measure',
+                   'since', 'until', 'top', 'pipeline', 'decompress_thread', 'windows',
+                   'profile', 'profile_memory', 'profile_dir', 'metrics', 'memory_budget'}
 
 
 def main():
@@ -17,22 +25,92 @@ def main():
         raise ImportError('Did not specify the correct input file!')
     if args.output is None:
         raise ImportError('Did not specify the correct output file!')
+    if args.state or args.append:
+        raise ImportError('Only border_crossing_statistics.py keeps an aggregate state!')
+    check_flags(args, 'border_crossing_statistics_optimized.py', SUPPORTED_FLAGS)
+    if args.memory_budget and (args.pipeline or args.workers > 1 or args.windows):
+        raise ImportError('Cannot spill the aggregation of the pipeline, workers, or windows!')
+
+    # Skip the rows of the borders, measures, and months that are not asked
+    # for while reading (the months before --since are still needed for the
+    # running averages, so those are dropped from the report only)
+    record_filter = RecordFilter(args.border, args.measure, args.until)
+
+    if args.memory_budget:
+
+        # Only imported when it is asked for, since tempfile is slow to import
+        from external_sort import SpillingTotals
+
+        # Spill the keys by their hash to bucket files once they take up the
+        # memory budget, and aggregate them bucket by bucket at the end
+        result = SpillingTotals(args.memory_budget)
+    else:
+        result = CrossingTotals()
+
+    # Time (and count the rows and allocations of) each phase, if asked to
+    profiler = Profiler.from_args('border_crossing_statistics_optimized', args)
+
+    # Only imported when it is asked for, since asyncio is slow to import
+    if args.pipeline:
+        import asyncio
+        from pipeline import aggregate_pipeline, write_pipeline
+
+    with profiler.phase('aggregate'):
+        if args.pipeline or (args.workers > 1 and not args.cache):
+
+            # Parse and aggregate line aligned byte ranges (or chunks, in the
+            # pipeline, while the next ones are read) of the input file in
+            # separate processes, then merge the partial sums together
+            if args.pipeline:
+                totals = asyncio.run(aggregate_pipeline(args.input, args.workers,
+                                                        record_filter))
+            else:
+                totals = aggregate_crossings_in_parallel(args.input, args.workers,
+                                                         record_filter)
+            for (border, date, measure), value in totals.items():
+                result.add(border, measure, date, value)
+        elif args.mmap or args.cache or record_filter:
+
+            # Decode only the Border, Date, Measure, and Value columns
+            for border, date, measure, value in record_filter(
+                    profiler.counted('input_rows', input_records(
+                        args.input, args.mmap, args.cache, args.decompress_thread))):
+                result.add(border, measure, date, value)
+        else:
+            with open_input(args.input, background=args.decompress_thread) as csv_file:
 
-    with open(args.input, mode='r') as csv_file:
+                csv_reader = csv.DictReader(csv_file, delimiter=',')
+                for row in profiler.counted('input_rows', csv_reader):
 
-        result = NestedDict()
-        csv_reader = csv.DictReader(csv_file, delimiter=',')
-        for row in csv_reader:
+                    # Add the value to the sum of its Border, Measure, and Date
+                    result.add(row['Border'], row['Measure'], row['Date'],
+                               parse_value(row['Value']))
 
-            # These are the keys
-            path = [row['Border'], row['Measure'], row['Date'], int(row['Value'])]
+    with profiler.phase('average_and_sort'):
+        final_list = find_average(result, args.since, args.top, args.memory_budget)
 
-            # The integer values
-            result[path] = 0
+    # Add the trailing averages of the reported rows out of a prefix sum
+    # index of the store
+    if args.windows:
+        from series_index import SeriesIndex, add_window_columns
+        with profiler.phase('windows'):
+            final_list = add_window_columns(final_list, SeriesIndex(result.series()),
+                                            args.windows, DateIndex())
 
-        final_list = find_average(result)
+    # The rows sorted through temporary files are merged as they are written
+    # (and the spilled keys only aggregated as they are sorted)
+    if args.memory_budget and args.top is None:
+        final_list = profiler.counted('report_rows', final_list)
+    else:
+        profiler.count('report_rows', len(final_list))
 
-    write_to_csv(args.output, final_list)
+    with profiler.phase('write'):
+        if args.pipeline:
+            asyncio.run(write_pipeline(args.output, final_list, args.windows))
+        else:
+            write_to_csv(args.output, final_list, args.windows)
+    profiler.count('aggregated_rows', len(result))
+    profiler.finish()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+"""Streaming decompression of compressed input files (.gz, .bz2, .xz, and .zip),
+   optionally in a background thread. Only imported when the input file is
+   compressed (see utils.open_input)."""
+
+import io
+import gzip
+import bz2
+import lzma
+import zipfile
+import queue
+import threading
+
+
+class BackgroundReader(io.RawIOBase):
+    """
+    Reads (and so decompresses) a stream in a background thread, a chunk at
+    a time, while the chunks already read are parsed. At most queue_size
+    chunks wait in between, so memory does not grow with the file.
+    """
+
+    def __init__(self, stream, chunk_size=1 << 20, queue_size=4):
+        super().__init__()
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = memoryview(b'')
+        self._done = False
+        self._stop = False
+        self._thread = threading.Thread(target=self._read_ahead, daemon=True)
+        self._thread.start()
+
+    def _read_ahead(self):
+        try:
+            while not self._stop:
+                chunk = self._stream.read(self._chunk_size)
+                self._queue.put(chunk)
+                if not chunk:
+                    break
+        except Exception as error:
+            self._queue.put(error)
+        finally:
+            self._stream.close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            if self._done:
+                return 0
+            chunk = self._queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self._done = True
+                return 0
+            self._pending = memoryview(chunk)
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        # Let the thread finish its last read, and drop what it read ahead
+        self._stop = True
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        super().close()
+
+
+def open_compressed(filename, binary=False, background=False):
+    """Opens a compressed input file, decompressing it as it is read.
+
+    Args:
+        filename: name of the .gz, .bz2, .xz, or .zip (the csv file in it) file
+        binary: if True, read bytes instead of text
+        background: if True, decompress in a background thread (see
+                    BackgroundReader)
+
+    Returns:
+        infile: file object
+    """
+
+    if filename.endswith('.gz'):
+        stream = gzip.open(filename, mode='rb')
+    elif filename.endswith('.bz2'):
+        stream = bz2.open(filename, mode='rb')
+    elif filename.endswith('.xz'):
+        stream = lzma.open(filename, mode='rb')
+    else:
+        # The member stays readable after the archive is closed
+        with zipfile.ZipFile(filename) as archive:
+            names = archive.namelist()
+            csv_names = [name for name in names if name.lower().endswith('.csv')]
+            stream = archive.open((csv_names or names)[0])
+
+    if background:
+        stream = io.BufferedReader(BackgroundReader(stream))
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
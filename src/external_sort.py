@@ -0,0 +1,226 @@
+"""Out of core sorting and aggregation (--memory-budget), for input files
+   whose rows (or distinct keys) do not fit in memory.
+
+   external_sorted sorts the records a bounded chunk at a time, spills each
+   sorted chunk to a temporary run file, and k-way merges the runs back with
+   heapq.merge. SpillingTotals adds up the values in a hash map until it
+   holds too many keys, then partitions them by hash into bucket files that
+   are aggregated one at a time."""
+
+import os
+import sys
+import heapq
+import pickle
+import tempfile
+
+from itertools import islice, groupby
+
+from utils import DateIndex
+
+# Most records pickled (and read back) at a time in a run file, and the
+# most runs merged at once (more runs are first merged into longer ones, so
+# the batches being merged fit in the memory budget too)
+RUN_BATCH_ROWS = 10000
+MERGE_FAN_IN = 16
+
+# Bucket files the keys are partitioned into once they are spilled, so a
+# bucket holds about 1/64 of the distinct keys
+SPILL_BUCKETS = 64
+
+
+def record_size(record):
+    """Estimates the bytes a record takes in memory: the tuple, its fields,
+       and the list slot that points to it."""
+    return sys.getsizeof(record) + sum(sys.getsizeof(field) for field in record) + 8
+
+
+def write_run(tmp_dir, records, batch_rows):
+    """Writes sorted records to a new run file in batches.
+
+    Returns:
+        filename (str): name of the run file
+    """
+
+    records = iter(records)
+    fd, filename = tempfile.mkstemp(suffix='.run', dir=tmp_dir)
+    with os.fdopen(fd, mode='wb') as run_file:
+        batch = list(islice(records, batch_rows))
+        while batch:
+            pickle.dump(batch, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+            batch = list(islice(records, batch_rows))
+    return filename
+
+
+def read_run(filename):
+    """Generator of the records of a run file, read back a batch at a time."""
+
+    with open(filename, mode='rb') as run_file:
+        while True:
+            try:
+                batch = pickle.load(run_file)
+            except EOFError:
+                return
+            yield from batch
+
+
+def external_sorted(records, key, memory_budget, tmp_dir=None, reverse=False):
+    """Sorts the records in chunks that fit in the memory budget, spills each
+       sorted chunk to a run file, and merges the runs back. If all the
+       records fit in one chunk nothing is written to disk.
+
+    Args:
+        records: iterable of (Border, Date, Measure, Value) records
+        key: sort key of a record, e.g. itemgetter(0, 1, 2)
+        memory_budget: bytes the records of a chunk may take
+        tmp_dir: directory of the run files (the system's default by default)
+        reverse: if True, sort in descending order
+
+    Yields:
+        record (tuple): the records in sorted order
+    """
+
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        return
+
+    # Size the chunks from the first record, so a chunk of records takes
+    # about the memory budget
+    chunk_rows = max(1, memory_budget // record_size(first))
+    chunk = [first] + list(islice(records, chunk_rows - 1))
+    chunk.sort(key=key, reverse=reverse)
+
+    # All of the records fit in memory
+    if len(chunk) < chunk_rows:
+        yield from chunk
+        return
+
+    # A batch of each of the runs being merged (and of the run they are
+    # merged into) fits in the memory budget
+    batch_rows = max(1, min(RUN_BATCH_ROWS, chunk_rows // (MERGE_FAN_IN + 1)))
+
+    with tempfile.TemporaryDirectory(prefix='bcs-sort-', dir=tmp_dir) as run_dir:
+        runs = []
+        while chunk:
+            runs.append(write_run(run_dir, chunk, batch_rows))
+            del chunk
+            chunk = list(islice(records, chunk_rows))
+            chunk.sort(key=key, reverse=reverse)
+
+        # Merge the oldest runs into longer ones until they can all be
+        # merged at once
+        while len(runs) > MERGE_FAN_IN:
+            merged, runs = runs[:MERGE_FAN_IN], runs[MERGE_FAN_IN:]
+            runs.append(write_run(run_dir, heapq.merge(*(read_run(run) for run in merged),
+                                                       key=key, reverse=reverse),
+                                  batch_rows))
+            for run in merged:
+                os.remove(run)
+
+        yield from heapq.merge(*(read_run(run) for run in runs), key=key, reverse=reverse)
+
+
+class SpillingTotals:
+    """
+    Aggregation store with the same add() as CrossingTotals, that keeps its
+    sums in memory until they take up the memory budget. Then every key is
+    spilled (with its partial sum) to one of the bucket files by the hash of
+    the key, and the store starts over empty. Since all of a key's partial
+    sums land in the same bucket, the buckets are aggregated one at a time,
+    each in about 1/SPILL_BUCKETS of the memory all the keys would take.
+    """
+
+    def __init__(self, memory_budget, tmp_dir=None):
+        self.memory_budget = memory_budget
+        self.tmp_dir = tmp_dir
+        self._totals = dict()
+        self._max_keys = None
+        self._run_dir = None
+        self._buckets = None
+        self._keys = 0
+
+    def __len__(self):
+        """Number of distinct keys (only known once the items are read, if
+           the keys were spilled)."""
+        return self._keys if self._buckets is not None else len(self._totals)
+
+    def add(self, border, measure, date, value):
+        """
+        Adds the value to the sum of the (border, measure, date) key.
+        """
+        key = (border, measure, date)
+        totals = self._totals
+        if key in totals:
+            totals[key] += value
+            return
+
+        # Size the store from the first key: the key, its sum, and the
+        # dictionary entry that holds them
+        if self._max_keys is None:
+            self._max_keys = max(1, self.memory_budget // (record_size(key) + 28 + 64))
+        totals[key] = value
+        if len(totals) >= self._max_keys:
+            self._spill()
+
+    def _spill(self):
+        """Appends the sums in memory to their bucket files, and empties the store."""
+
+        if self._buckets is None:
+            self._run_dir = tempfile.TemporaryDirectory(prefix='bcs-spill-', dir=self.tmp_dir)
+            self._buckets = [open(os.path.join(self._run_dir.name, '{}.bucket'.format(i)),
+                                  mode='wb') for i in range(SPILL_BUCKETS)]
+
+        partitions = [[] for _ in range(SPILL_BUCKETS)]
+        for item in self._totals.items():
+            partitions[hash(item[0]) % SPILL_BUCKETS].append(item)
+        self._totals.clear()
+
+        for bucket, partition in zip(self._buckets, partitions):
+            if partition:
+                pickle.dump(partition, bucket, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def items(self):
+        """
+        Generator of ((border, measure, date), sum) pairs in (Border, Measure,
+        Date) order, with the dates in chronological order.
+        """
+        date_index = DateIndex()
+
+        def series_order(item):
+            (border, measure, date), _ = item
+            return border, measure, date_index[date]
+
+        # Nothing was spilled, so the sums are all in memory
+        if self._buckets is None:
+            yield from sorted(self._totals.items(), key=series_order)
+            return
+
+        self._spill()
+        for bucket in self._buckets:
+            bucket.close()
+
+        with self._run_dir as run_dir:
+
+            # Aggregate each bucket on its own, and write its sums out sorted
+            # as a run, so the runs can be merged into one ordered stream
+            batch_rows = max(1, min(RUN_BATCH_ROWS, self._max_keys // (SPILL_BUCKETS + 1)))
+            runs, self._keys = [], 0
+            for bucket in self._buckets:
+                totals = dict()
+                for key, value in read_run(bucket.name):
+                    totals[key] = totals.get(key, 0) + value
+                self._keys += len(totals)
+                runs.append(write_run(run_dir, sorted(totals.items(), key=series_order),
+                                      batch_rows))
+                os.remove(bucket.name)
+                del totals
+
+            yield from heapq.merge(*(read_run(run) for run in runs), key=series_order)
+
+    def series_items(self):
+        """
+        Generator of ((border, measure), {date: sum}) pairs, one Border and
+        Measure at a time, with the dates in chronological order.
+        """
+        for series, items in groupby(self.items(), key=lambda item: item[0][:2]):
+            yield series, {date: value for (_, _, date), value in items}
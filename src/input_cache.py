@@ -0,0 +1,182 @@
+"""Binary column cache of the parsed input file (--cache).
+
+   The cache sits next to the input file (<input>.cache) and holds the parsed
+   input as columns: a dictionary of the distinct borders, dates, and measures,
+   a column of integer codes into each dictionary, and an int64 column of the
+   values. It is laid out as
+
+       magic | header length | json header | padding | values | border codes
+             | date codes | measure codes
+
+   so that every column can be used straight out of a memory map.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import mmap
+
+from array import array
+
+from utils import input_records
+
+CACHE_MAGIC = b'BXCACHE1'
+
+
+def hash_file(filename):
+    """Returns the sha256 hex digest of a file's contents."""
+
+    sha = hashlib.sha256()
+    with open(filename, mode='rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def smallest_typecode(count):
+    """Returns the smallest unsigned array typecode that holds count codes."""
+
+    for typecode in ('B', 'H', 'I', 'L', 'Q'):
+        if count <= 2 ** (8 * array(typecode).itemsize):
+            return typecode
+
+
+def write_input_cache(filename, cache_filename):
+    """Parses the input file and writes it out as a binary column cache.
+
+    Args:
+        filename: name of the input file
+        cache_filename: name of the cache file
+    """
+
+    stat = os.stat(filename)
+    dictionaries = (dict(), dict(), dict())
+    columns = (array('L'), array('L'), array('L'))
+    values = array('q')
+
+    for record in input_records(filename, use_mmap=True):
+        for dictionary, column, string in zip(dictionaries, columns, record):
+            column.append(dictionary.setdefault(string, len(dictionary)))
+        values.append(record[3])
+
+    columns = [array(smallest_typecode(len(dictionary)), column)
+               for dictionary, column in zip(dictionaries, columns)]
+
+    header = json.dumps({'size': stat.st_size,
+                         'mtime_ns': stat.st_mtime_ns,
+                         'sha256': hash_file(filename),
+                         'byteorder': sys.byteorder,
+                         'rows': len(values),
+                         'borders': list(dictionaries[0]),
+                         'dates': list(dictionaries[1]),
+                         'measures': list(dictionaries[2]),
+                         'typecodes': [column.typecode for column in columns]}).encode('utf-8')
+
+    # Write to a temporary file first, so a half written cache is never read
+    with open(cache_filename + '.tmp', mode='wb') as cache_file:
+        cache_file.write(CACHE_MAGIC)
+        cache_file.write(len(header).to_bytes(8, 'little'))
+        cache_file.write(header)
+        cache_file.write(b'\0' * (-cache_file.tell() % 8))
+        values.tofile(cache_file)
+        for column in columns:
+            column.tofile(cache_file)
+
+    os.replace(cache_filename + '.tmp', cache_filename)
+
+
+def read_cache_header(cache_filename):
+    """Reads the json header of the cache file.
+
+    Returns:
+        header (dict): the header, or None if the file is not a cache file
+        offset (int): where the columns start
+    """
+
+    with open(cache_filename, mode='rb') as cache_file:
+        if cache_file.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None, 0
+        length = int.from_bytes(cache_file.read(8), 'little')
+        header = json.loads(cache_file.read(length).decode('utf-8'))
+
+    offset = len(CACHE_MAGIC) + 8 + length
+    return header, offset + (-offset % 8)
+
+
+def is_cache_fresh(filename, cache_filename):
+    """Checks whether the cache file was built from the input file as it is
+       now. The size has to match, and if the modification time does not,
+       the contents have to hash the same.
+    """
+
+    if not os.path.exists(cache_filename):
+        return False
+
+    header, _ = read_cache_header(cache_filename)
+    stat = os.stat(filename)
+    if header is None or header['byteorder'] != sys.byteorder or \
+            header['size'] != stat.st_size:
+        return False
+
+    return header['mtime_ns'] == stat.st_mtime_ns or header['sha256'] == hash_file(filename)
+
+
+def open_input_cache(filename):
+    """Builds the binary column cache of the input file if it is missing or
+       stale, and reads its header.
+
+    Args:
+        filename: name of the input file
+
+    Returns:
+        cache_filename (str): name of the cache file
+        header (dict): the json header of the cache
+        offset (int): where the columns start
+    """
+
+    cache_filename = filename + '.cache'
+    if not is_cache_fresh(filename, cache_filename):
+        write_input_cache(filename, cache_filename)
+
+    header, offset = read_cache_header(cache_filename)
+    return cache_filename, header, offset
+
+
+def cached_records(filename):
+    """Reads the input file through its binary column cache, building the
+       cache first if it is missing or stale. The columns are used straight
+       out of a memory map of the cache file, so nothing is parsed.
+
+    Args:
+        filename: name of the input file
+
+    Yields:
+        record (tuple): (Border, Date, Measure, Value)
+    """
+
+    cache_filename, header, offset = open_input_cache(filename)
+    rows = header['rows']
+    if rows == 0:
+        return
+
+    with open(cache_filename, mode='rb') as cache_file, \
+            mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+        view = memoryview(data)
+        columns = []
+        for typecode in ['q'] + header['typecodes']:
+            size = rows * array(typecode).itemsize
+            columns.append(view[offset:offset + size].cast(typecode))
+            offset += size
+
+        values, border_codes, date_codes, measure_codes = columns
+        try:
+            yield from zip(map(header['borders'].__getitem__, border_codes),
+                           map(header['dates'].__getitem__, date_codes),
+                           map(header['measures'].__getitem__, measure_codes),
+                           values)
+        finally:
+            for column in columns:
+                column.release()
+            view.release()
@@ -0,0 +1,184 @@
+"""Vectorized NumPy backend of border_crossing_statistics (--engine numpy).
+   The Border, Date, and Measure strings are encoded as integer codes, so
+   the sums, running averages, and the final sort all run on arrays."""
+
+import numpy as np
+
+from array import array
+
+from utils import DateIndex
+from input_cache import open_input_cache
+
+
+def encode_records(records):
+    """Encodes the Border, Date, and Measure of each record as an integer code
+       into a list of the distinct strings. The records are encoded one at a
+       time as they stream in, into compact arrays of codes (as in
+       input_cache.write_input_cache), so neither the records nor a column
+       of Python objects are ever held in memory.
+
+    Args:
+        records: iterable of (Border, Date, Measure, Value) records
+
+    Returns:
+        dictionaries (tuple): the distinct borders, dates, and measures
+        columns (tuple): the border, date, and measure code arrays and
+                         the value array
+    """
+
+    # The distinct strings in the order they are first seen, and their codes
+    dictionaries = (dict(), dict(), dict())
+    columns = (array('q'), array('q'), array('q'), array('q'))
+
+    borders, dates, measures = dictionaries
+    border_codes, date_codes, measure_codes, values = columns
+    for border, date, measure, value in records:
+        border_codes.append(borders.setdefault(border, len(borders)))
+        date_codes.append(dates.setdefault(date, len(dates)))
+        measure_codes.append(measures.setdefault(measure, len(measures)))
+        values.append(value)
+
+    return (tuple(list(dictionary) for dictionary in dictionaries),
+            tuple(np.frombuffer(column, dtype=np.int64) for column in columns))
+
+
+def load_cached_columns(filename, record_filter=None):
+    """Reads the columns of the binary column cache of the input file (see
+       input_cache.write_input_cache) straight into arrays.
+
+    Args:
+        filename: name of the input file
+        record_filter: RecordFilter of the rows to keep (all rows by default)
+
+    Returns:
+        the same dictionaries and columns as encode_records
+    """
+
+    cache_filename, header, offset = open_input_cache(filename)
+    rows = header['rows']
+
+    columns = []
+    for typecode in ['q'] + header['typecodes']:
+        dtype = np.dtype(typecode)
+        columns.append(np.fromfile(cache_filename, dtype=dtype, count=rows,
+                                   offset=offset).astype(np.int64))
+        offset += rows * dtype.itemsize
+
+    values, border_codes, date_codes, measure_codes = columns
+    dictionaries = (header['borders'], header['dates'], header['measures'])
+    columns = (border_codes, date_codes, measure_codes, values)
+
+    if record_filter:
+        columns = filter_columns(dictionaries, columns, record_filter)
+    return dictionaries, columns
+
+
+def filter_columns(dictionaries, columns, record_filter):
+    """Keeps only the rows that pass the record filter, by looking up whether
+       each distinct string passes once and masking the code arrays.
+
+    Args:
+        dictionaries: the distinct borders, dates, and measures
+        columns: the border, date, and measure code arrays and the value array
+        record_filter: RecordFilter of the rows to keep
+
+    Returns:
+        columns (tuple): the filtered code arrays and value array
+    """
+
+    borders, dates, measures = dictionaries
+    border_codes, date_codes, measure_codes, values = columns
+    date_index = DateIndex()
+
+    keep = np.ones(len(values), dtype=bool)
+    if record_filter.borders is not None:
+        keep &= np.array([b in record_filter.borders for b in borders], dtype=bool)[border_codes]
+    if record_filter.measures is not None:
+        keep &= np.array([m in record_filter.measures for m in measures],
+                         dtype=bool)[measure_codes]
+    if record_filter.until is not None:
+        keep &= np.array([date_index[d] <= record_filter.until for d in dates],
+                         dtype=bool)[date_codes]
+
+    return tuple(column[keep] for column in columns)
+
+
+def ranks(strings):
+    """Returns the position of each string in sorted order, as an array."""
+
+    rank = np.empty(len(strings), dtype=np.int64)
+    rank[sorted(range(len(strings)), key=strings.__getitem__)] = np.arange(len(strings))
+    return rank
+
+
+def numpy_report(dictionaries, columns, since=None, top=None):
+    """Sums the values of each (Border, Date, Measure), finds the average of
+       the previous months of each Border and Measure, and sorts the report
+       by Date, Value, Measure, and Border in descending order.
+
+    Args:
+        dictionaries: the distinct borders, dates, and measures
+        columns: the border, date, and measure code arrays and the value array
+        since: first ordinal month to report (all months by default)
+        top: number of rows to report (all rows by default)
+
+    Returns:
+        final_sorted_list (list): the report rows
+                                  (<Border>, <Date>, <Measure>, <Value>, <Average>)
+    """
+
+    borders, dates, measures = dictionaries
+    border_codes, date_codes, measure_codes, values = columns
+    if len(values) == 0:
+        return []
+
+    # Number the dates in chronological order
+    date_index = DateIndex()
+    months = np.array([date_index[date] for date in dates], dtype=np.int64)
+    date_ranks = np.empty(len(dates), dtype=np.int64)
+    date_ranks[np.argsort(months, kind='stable')] = np.arange(len(dates))
+
+    # One key per (Border, Measure, Date) that sorts the months of each
+    # Border and Measure chronologically
+    series = border_codes * len(measures) + measure_codes
+    keys, inverse = np.unique(series * len(dates) + date_ranks[date_codes],
+                              return_inverse=True)
+    sums = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(sums, inverse.ravel(), values)
+
+    # Grouped cumulative sum of the previous months of each Border and Measure
+    series = keys // len(dates)
+    starts = np.flatnonzero(np.r_[True, series[1:] != series[:-1]])
+    group = np.cumsum(np.r_[True, series[1:] != series[:-1]]) - 1
+    previous_sums = np.cumsum(sums) - sums
+    previous_sums -= previous_sums[starts][group]
+    previous_counts = np.arange(len(keys)) - starts[group]
+
+    # Round the same way as utils.my_round: down if less than .5, otherwise up
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quotients = previous_sums / previous_counts
+    floors = np.floor(quotients)
+    averages = np.where(previous_counts == 0, 0,
+                        np.where(quotients - floors < 0.5, floors, floors + 1)).astype(np.int64)
+
+    # Decode the keys back into Border, Measure, and Date codes
+    date_of_key = np.argsort(date_ranks)[keys % len(dates)]
+    border_of_key = series // len(measures)
+    measure_of_key = series % len(measures)
+
+    # Sort by Date, Value, Measure, Border in descending order
+    order = np.lexsort((ranks(borders)[border_of_key], ranks(measures)[measure_of_key],
+                        sums, months[date_of_key]))[::-1]
+
+    # Drop the months before since (they were only needed for the averages)
+    # and keep the top rows
+    if since is not None:
+        order = order[months[date_of_key][order] >= since]
+    if top is not None:
+        order = order[:top]
+
+    return [[borders[border], dates[date], measures[measure], value, average]
+            for border, date, measure, value, average in
+            zip(border_of_key[order].tolist(), date_of_key[order].tolist(),
+                measure_of_key[order].tolist(), sums[order].tolist(),
+                averages[order].tolist())]
@@ -0,0 +1,432 @@
+"""Aggregation store and running averages of the optimized script
+   (border_crossing_statistics_optimized.py)."""
+
+from array import array
+
+from utils import my_round, DateIndex, sort_report
+
+
+class CrossingTotals:
+    """
+    Compact aggregation store for the crossings. Each (border, measure, date)
+    key is mapped to a slot of an array of 64-bit integer sums, so adding a
+    value costs one dictionary lookup and the sums take 8 bytes each instead
+    of a Python int object.
+    """
+    __slots__ = ('_slots', '_sums')
+
+    def __init__(self):
+        self._slots = dict()
+        self._sums = array('q')
+
+    def __len__(self):
+        return len(self._sums)
+
+    def add(self, border, measure, date, value):
+        """
+        Adds the value to the sum of the (border, measure, date) key.
+        """
+        key = (border, measure, date)
+        slot = self._slots.get(key)
+        if slot is None:
+            self._slots[key] = len(self._sums)
+            self._sums.append(value)
+        else:
+            self._sums[slot] += value
+
+    def items(self):
+        """
+        Generator of ((border, measure, date), sum) pairs.
+        """
+        sums = self._sums
+        for key, slot in self._slots.items():
+            yield key, sums[slot]
+
+    def series(self):
+        """
+        Groups the sums by border and measure. Returns a dictionary of
+        (border, measure) keys and {date: sum} values.
+        """
+        grouped = dict()
+        for (border, measure, date), value in self.items():
+            grouped.setdefault((border, measure), {})[date] = value
+        return grouped
+
+    def series_items(self):
+        """
+        Iterable of ((border, measure), {date: sum}) pairs (see series).
+        """
+        return self.series().items()
+
+
+class NestedDict(dict):
+    """
+    Class for managing nested dictionary structures. Normally, it works
+    like a builtin dictionary. However, if it gets a list as an argument,
+    it will iterate through that list assuming all elements of that list
+    as a key for the subdirectory chain.
+
+    NestedDict implements module level functions and makes managing nested
+    dictionary structure easier.
+
+    Instead of having a complicated way to manage extending or
+    overwriting, NestedDict has a lock property (not decorated!) which
+    allows or prohibits all alterations on the particular NestedDict
+    instance. Warning! If you do not pass a list (even if it has only one
+    element) to __setitem__, the superclass' method will be used which
+    sets the item regardless of lock state!
+
+    If you want more sophisticated behavior than full access/prohibition,
+    you can still use module level functions.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = False
+
+    def __getitem__(self, *args):
+        if isinstance(args[0], list):
+            return getitem(self, args[0])
+        return super().__getitem__(*args)
+
+    def __setitem__(self, *args):
+        if isinstance(args[0], list):
+            lock = self.get_lock(args[0])
+            if not lock:
+                return setitem(self, args[0], args[1],
+                               overwrite=not lock, restruct=not lock,
+                               dict_type=type(self))
+            else:
+                return False
+        else:
+            super().__setitem__(*args)
+            return True
+
+    def get_lock(self, path):
+        """
+        Returns the state of lock on the given path. In fact it walks on
+        the path as long as possible, and returns the state of the last
+        lock it can get.
+        """
+        lock = self.lock
+        level = 1
+        while level <= len(path):
+            try:
+                lock = getitem(self, path[:level]).lock
+            except (KeyError, AttributeError):
+                break
+            level += 1
+        return lock
+
+    def func_if_unlocked(self, *args):
+        """
+        The default func_if_unlocked function for self.merge() method
+        which checks for lock on a path and returns True if path is
+        unlocked.
+        """
+        path = args[0]
+        return not self.get_lock(path)
+
+    def lock_close(self, recursively=True):
+        """
+        Locks locks.
+        """
+        self.lock = True
+        if recursively:
+            for p in self.paths(of_values=False):
+                self.__getitem__(p).lock = True
+
+    def lock_open(self, recursively=True):
+        """
+        Unlocks locks.
+        """
+        self.lock = False
+        if recursively:
+            for p in self.paths(of_values=False):
+                self.__getitem__(p).lock = False
+
+    def merge(self, *dictobjs, restruct=True):
+        """
+        Same as module level function merge. It needs less arguments
+        though since it uses self.func_if_unlocked() method to manage
+        extend and overwrite permissions.
+        """
+        merge(self, *dictobjs,
+              func_if_extend=self.func_if_unlocked,
+              func_if_overwrite=self.func_if_unlocked,
+              restruct=restruct,
+              dict_type=type(self))
+
+    def paths(self, of_values=True):
+        """
+        Same as module level function paths.
+        """
+        return paths(self, of_values=of_values)
+
+
+def getitem(dictobj, path):
+    """
+    Returns the element of a nested dictionary structure which is on the
+    given path.
+    """
+    _validate_path(path)
+    if len(path) == 1:
+        return dictobj[path[0]]
+    else:
+        return getitem(dictobj[path[0]], path[1:])
+
+
+def setitem(dictobj, path, value, overwrite=True, restruct=True,
+        dict_type=dict):
+    """
+    Sets a dictionary item on a given path to a given value.
+      - Returns True if value on path has been set.
+      - Returns False if there was a value on the given path which was not
+        overwritten by the function.
+      - Returns None if there was a value on the given path which was
+        identical to value.
+
+    If restruct=True then when a value blocks the path, that value get
+    cleared by an empty dictionary to make way forward.
+    """
+    _validate_path(path)
+
+    try:
+        one_step = dictobj[path[0]]
+    except KeyError:
+        if len(path) == 1:
+            dictobj[path[0]] = value
+            return True
+        else:
+            dictobj[path[0]] = dict_type()
+            one_step = dictobj[path[0]]
+    else:
+        if len(path) == 1 and one_step == value:
+            return None
+        elif len(path) == 1 and overwrite is False:
+            return False
+        elif len(path) == 1 and overwrite is True:
+            dictobj[path[0]] = value
+            return True
+        else:
+            if not isinstance(one_step, dict):
+                if overwrite is True and restruct is True: ##TEST
+                    dictobj[path[0]] = dict_type()
+                    one_step = dictobj[path[0]]
+                else:
+                    return False
+    return setitem(one_step, path[1:], value, overwrite=overwrite,
+                restruct=restruct, dict_type=dict_type)
+
+
+def paths(dictobj, of_values=True, past_keys=[]):
+    """
+    Generator to iterate through branches. Used by merge function, but
+    can be useful for other object management stuffs.
+
+    By default it returns paths of values. However, if of_values=False
+    then it returns the paths of all subdirectories.
+    """
+    for key in dictobj.keys():
+        path = past_keys + [key]
+        if not isinstance(dictobj[key], dict):
+            if of_values is True:
+                yield path
+        else:
+            if of_values is False:
+                yield path
+            yield from paths(dictobj[key], of_values=of_values,
+                             past_keys=path)
+
+
+def merge(*dictobjs,
+          func_if_extend=True,
+          func_if_overwrite=True,
+          restruct=True,
+          dict_type=dict,
+          return_new=False):
+    """
+    Merges one dictionary with one or more another.
+
+    By default it mutates the first dictobj. However, if return_new=True
+    then it returns a new dictionary object typed recursively to
+    dict_type. If you want no retypeing, use copy.deepcopy(), and pass the
+    copied dictionary as first argument.
+
+    To make mergeing more flexible, you are able to control how extension
+    overwriting should be done (both are allowed by default). By setting
+    func_if_overwrite to False, overwriting becomes disabled. By setting
+    func_if_extend to False, extension becomes disabled and you can only
+    update existing values if overwriting is enabled. If both are
+    disabled, no alteration will be made, so this scenario makes no sense,
+    but allowed.
+
+    Moreover you can pass functions to the two mentioned arguments which
+    will be called with the path (list of keys), dictobj1, dictobj2
+    arguments and expected to return True or False.
+    """
+    if return_new is True:
+        d = retype(dictobjs[0], dict_type)
+    elif return_new is False:
+        d = dictobjs[0]
+
+    for dictobj in dictobjs[1:]:
+        for p in paths(dictobj):
+            try:
+                getitem(d, p)
+            except KeyError:
+                    if hasattr(func_if_extend, '__call__'):
+                        ex = func_if_extend(p, d, dictobj)
+                    else:
+                        ex = func_if_extend
+                    if ex:
+                        setitem(d, p, getitem(dictobj, p),
+                                dict_type=dict_type)
+            else:
+                if getitem(d, p) != getitem(dictobj, p):
+                    if hasattr(func_if_overwrite, '__call__'):
+                        ow = func_if_overwrite(p, d, dictobj)
+                    else:
+                        ow = func_if_overwrite
+                    restruct_ = restruct and ow
+                    setitem(d, p, getitem(dictobj, p),
+                            overwrite=ow,
+                            restruct=restruct_,
+                            dict_type=dict_type)
+    return d
+
+
+def retype(dictobj, dict_type):
+    """
+    Recursively modifies the type of a dictionary object and returns a new
+    dictionary of type dict_type. You can also use this function instead
+    of copy.deepcopy() for dictionaries.
+    """
+    def walker(dictobj):
+        for k in dictobj.keys():
+            if isinstance(dictobj[k], dict):
+                yield (k, dict_type(walker(dictobj[k])))
+            else:
+                yield (k, dictobj[k])
+    d = dict_type(walker(dictobj))
+    return d
+
+
+def _validate_path(path):
+    if not isinstance(path, list):
+        raise TypeError('path argument have to be a list')
+    if not path:
+        raise Exception('path argument have to be a nonempty list')
+
+
+def cumulative_average(values_list):
+    """" Gathers the cumulative average for each measure.
+         So if the values list has more than one value,
+         then there will be two numbers, the total sum at
+         that step as well as the cumulative average.
+
+    Args:
+        values_list: list of values of the specific measure
+
+    Return:
+        list: if there are not multiple values, then return
+              the singular value and 0, otherwise return
+              the value at each step of the cumulative average.
+    """
+
+    if len(values_list) == 1:
+        for value in values_list:
+            return [tuple((value, 0))]
+
+    new_list = [0] * len(values_list)
+
+    new_p, counter = 0, 0
+    for i in range(len(values_list)-1, -1, -1):
+        new_list[i] = new_p
+        new_p += values_list[i]
+
+        if counter >= 1:
+            new_list[i] = my_round(new_list[i]/counter)
+
+        counter += 1
+
+    return list(zip(values_list, new_list))
+
+
+def find_the_bloody_key(total_list, result_key, measure_key, measure_values):
+    """From the list of all the measure values, gets the values at each step.
+       For instance, at step 0, Cars passing in Canada-US border is 6,800. At
+       step 1, Cars passing in Canada-US border is 7,000--so the average is 14,800.
+       The dates, sums, and cumulative averages are walked once, side by side,
+       so a series of n months costs O(n).
+
+       Args:
+           total_list: list of all measure values (number, and cumulative average)
+           result_key: name of border
+           measure_key: name of measure
+           measure_values: dictionary of the dates (most recent first) and their values
+
+       Yields:
+            row (list): (<Border>, <Date>, <Measure>, <Value>, <Average>) of each date
+
+        Raises:
+            IndexError: if total_list is emtpy
+            ValueError: if total_list and measure_values are not the same length
+       """
+
+    if not total_list:
+        raise IndexError("Error! The list of cumulative average is empty.")
+    if len(total_list) != len(measure_values):
+        raise ValueError("Error: total_list does not have a pair of values for each date.")
+
+    # saves in this order: <Border>, <Date>, <Measure>, <Value>, <Average>
+    for date, (value, average) in zip(measure_values, total_list):
+        yield [result_key, date, measure_key, value, average]
+
+
+def series_rows(result, date_index):
+    """Generator of the report rows of every Border and Measure, with the
+       cumulative average of each month (see find_the_bloody_key).
+
+       Args:
+           result: CrossingTotals (or SpillingTotals) of all the data
+           date_index: DateIndex mapping each date to its ordinal month
+
+       Yields:
+            row (list): (<Border>, <Date>, <Measure>, <Value>, <Average>)
+    """
+
+    for (result_key, measure_key), measure_value in result.series_items():
+
+        # Put the most recent month first
+        measure_values = {date: measure_value[date]
+                          for date in sorted(measure_value, key=date_index.__getitem__,
+                                             reverse=True)}
+
+        total_list = cumulative_average(list(measure_values.values()))
+        yield from find_the_bloody_key(total_list, result_key, measure_key, measure_values)
+
+
+def find_average(result, since=None, top=None, memory_budget=None):
+    """Iterate through the various keys and values,
+       until we find the specific one of interest. Find the cumulative average.
+       Place that in the final list, and sort it by the Date, Value, Measure, and
+       Border.
+
+       Args:
+           result: CrossingTotals (or SpillingTotals) of all the data
+           since: first ordinal month to report (all months by default)
+           top: number of rows to report (all rows by default)
+           memory_budget: if given, the bytes of rows to sort in memory at a
+                          time (see sort_report)
+
+        Returns:
+            final_sorted_list: list of sorted items (an iterator of them if
+                               sorted through temporary files)
+
+    """
+
+    # Sort the rows by Date, Value, Measure, Border in descending order as
+    # they are generated, without building an unsorted list of them first
+    date_index = DateIndex()
+    return sort_report(series_rows(result, date_index), date_index, since, top,
+                       memory_budget)
@@ -0,0 +1,179 @@
+"""Asyncio pipeline (--pipeline) that overlaps reading the input file,
+   parsing and aggregating it, and writing the report out. Only imported when
+   it is asked for, since asyncio is slow to import."""
+
+import asyncio
+import csv
+import io
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils import read_records, aggregate_crossings, RecordFilter, open_input, ReportWriter
+
+# Bytes read at a time, report rows formatted at a time, and the number of
+# chunks (or batches) a queue holds before its producer has to wait, which
+# caps the memory of the pipeline
+PIPELINE_CHUNK_SIZE = 1 << 20
+PIPELINE_BATCH_ROWS = 10000
+PIPELINE_QUEUE_SIZE = 4
+
+
+def aggregate_chunk(chunk, record_filter):
+    """Parses and aggregates a chunk of whole lines of the input file. Can run
+       inside a worker process, so it has to be a module level function.
+
+    Args:
+        chunk: bytes of whole lines of the input file
+        record_filter: RecordFilter to apply while parsing
+
+    Returns:
+        totals (dict): the aggregated value for each (Border, Date, Measure)
+    """
+
+    return aggregate_crossings(record_filter(read_records(
+        csv.reader(io.StringIO(chunk.decode('utf-8')), delimiter=','))))
+
+
+async def read_chunks(filename, queue, consumers, chunk_size=PIPELINE_CHUNK_SIZE):
+    """Reads the input file (without its column headers) in chunks that end on
+       line boundaries, in a thread so the event loop is never blocked, and
+       puts them on the queue. Then puts one None for each consumer.
+
+    Args:
+        filename: name of the input file
+        queue: bounded asyncio.Queue of the chunks
+        consumers: number of tasks reading the queue
+        chunk_size: number of bytes to read at a time
+    """
+
+    loop = asyncio.get_running_loop()
+
+    with open_input(filename, binary=True) as infile:
+
+        # Skip the column headers
+        await loop.run_in_executor(None, infile.readline)
+
+        rest = b''
+        while True:
+            data = await loop.run_in_executor(None, infile.read, chunk_size)
+            if not data:
+                break
+
+            # Keep the partial last line for the next chunk
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            if cut:
+                await queue.put(data[:cut])
+
+        if rest:
+            await queue.put(rest)
+
+    for _ in range(consumers):
+        await queue.put(None)
+
+
+async def aggregate_chunks(queue, executor, record_filter, totals):
+    """Takes the chunks off the queue, parses and aggregates each of them in
+       the executor, and merges the partial sums into the totals.
+
+    Args:
+        queue: bounded asyncio.Queue of the chunks
+        executor: thread or process pool to parse the chunks in
+        record_filter: RecordFilter to apply while parsing
+        totals: dictionary of totals to add to
+    """
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+        chunk = await queue.get()
+        if chunk is None:
+            return
+        partial_totals = await loop.run_in_executor(executor, aggregate_chunk, chunk,
+                                                    record_filter)
+        for key, value in partial_totals.items():
+            totals[key] = totals.get(key, 0) + value
+
+
+async def aggregate_pipeline(filename, workers=1, record_filter=None,
+                             queue_size=PIPELINE_QUEUE_SIZE):
+    """Reads the input file while the chunks already read are parsed and
+       aggregated, in one thread or in several worker processes. At most
+       queue_size chunks wait in between.
+
+       Note: a row must not span more than one line (no quoted newlines).
+
+    Args:
+        filename: name of the input file
+        workers: number of worker processes (a thread if 1)
+        record_filter: RecordFilter to apply while parsing
+        queue_size: number of chunks the queue holds
+
+    Returns:
+        totals (dict): the aggregated value for each (Border, Date, Measure)
+    """
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    record_filter = record_filter or RecordFilter()
+    totals = dict()
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else ThreadPoolExecutor(1)
+    with executor:
+        await asyncio.gather(read_chunks(filename, queue, workers),
+                             *(aggregate_chunks(queue, executor, record_filter, totals)
+                               for _ in range(workers)))
+
+    return totals
+
+
+async def format_batches(writer, final_list, queue, batch_rows=PIPELINE_BATCH_ROWS):
+    """Formats the report rows as csv text, a batch of rows at a time, and puts
+       the batches on the queue, then None.
+
+    Args:
+        writer: ReportWriter of the output file
+        final_list: the report rows
+        queue: bounded asyncio.Queue of the formatted batches
+        batch_rows: number of rows to format at a time
+    """
+
+    for start in range(0, len(final_list), batch_rows):
+        await queue.put(writer.format(final_list[start:start + batch_rows]))
+    await queue.put(None)
+
+
+async def write_batches(writer, queue):
+    """Writes the formatted batches off the queue out through the writer, in a
+       thread so the next batch can be formatted in the meantime.
+
+    Args:
+        writer: ReportWriter of the output file
+        queue: bounded asyncio.Queue of the formatted batches
+    """
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            return
+        await loop.run_in_executor(None, writer.write, batch)
+
+
+async def write_pipeline(name_of_output_file, final_list, windows=None,
+                         queue_size=PIPELINE_QUEUE_SIZE):
+    """Writes the report out to the csv file (the same as write_to_csv), with
+       the formatting of the rows overlapping the writing.
+
+    Args:
+        name_of_output_file: name of the output file
+        final_list: the report rows
+        windows: the trailing average windows of the rows (see --windows)
+        queue_size: number of formatted batches the queue holds
+    """
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    with ReportWriter(name_of_output_file, windows) as writer:
+        await asyncio.gather(format_batches(writer, final_list, queue),
+                             write_batches(writer, queue))
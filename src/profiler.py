@@ -0,0 +1,179 @@
+"""Per-phase timers and row counters (--profile), and allocation metrics
+   (--profile-memory). tracemalloc and cProfile are only imported when they
+   are asked for."""
+
+import os
+import sys
+import json
+import time
+
+from contextlib import contextmanager
+
+
+class Profiler:
+    """
+    Times each phase of a run and counts the rows it handles, optionally
+    with the memory it allocates (with tracemalloc, which slows every
+    allocation down, so it has its own switch) and a cProfile dump of each
+    phase. The time spent on the profiler's own bookkeeping between the
+    phases is kept apart as its overhead. When profiling is off a phase is a
+    plain with block, so the scripts can always go through a Profiler.
+    """
+
+    def __init__(self, script, enabled=False, profile_dir=None, metrics_file=None,
+                 trace_memory=False):
+        self.script = script
+        self.enabled = enabled or bool(profile_dir or metrics_file or trace_memory)
+        self.profile_dir = profile_dir
+        self.metrics_file = metrics_file
+        self.trace_memory = trace_memory
+        self.phases = dict()
+        self.counters = dict()
+        self.overhead = 0.0
+
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @classmethod
+    def from_args(cls, script, args):
+        return cls(script, args.profile, args.profile_dir, args.metrics, args.profile_memory)
+
+    @contextmanager
+    def phase(self, name):
+        """Times the with block as the named phase, and (if tracing memory)
+           measures the memory it allocated: the change in traced bytes, and
+           the peak."""
+
+        if not self.enabled:
+            yield
+            return
+
+        overhead_start = time.perf_counter()
+        if self.trace_memory:
+            import tracemalloc
+            bytes_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        profile = None
+        if self.profile_dir:
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+
+        start = time.perf_counter()
+        self.overhead += start - overhead_start
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(os.path.join(self.profile_dir,
+                                                '{}.{}.prof'.format(self.script, name)))
+
+            self.phases[name] = {'seconds': seconds}
+            if self.trace_memory:
+                bytes_after, peak = tracemalloc.get_traced_memory()
+                self.phases[name].update(net_bytes=bytes_after - bytes_before,
+                                         peak_bytes=peak - bytes_before)
+            self.overhead += time.perf_counter() - start - seconds
+
+    def count(self, name, rows):
+        """Adds the number of rows to the named counter."""
+
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + rows
+
+    def counted(self, name, records):
+        """Counts the records into the named counter as they go by."""
+
+        if not self.enabled:
+            return records
+        return self._counted(name, records)
+
+    def _counted(self, name, records):
+        count = 0
+        try:
+            for record in records:
+                count += 1
+                yield record
+        finally:
+            self.count(name, count)
+
+    def finish(self):
+        """Prints the summary table, writes the metrics file, and stops
+           tracing the allocations."""
+
+        if not self.enabled:
+            return
+
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.stop()
+
+        print(self.summary(), file=sys.stderr)
+        if self.metrics_file:
+            with open(self.metrics_file, mode='w') as metrics_file:
+                if self.metrics_file.endswith('.prom'):
+                    metrics_file.write(self.prometheus())
+                else:
+                    json.dump({'script': self.script, 'phases': self.phases,
+                               'overhead_seconds': self.overhead,
+                               'counters': self.counters}, metrics_file, indent=2)
+
+    def summary(self):
+        """Returns the phases, the profiler's overhead, and the counters as a table."""
+
+        lines = []
+        if self.trace_memory:
+            lines.append('(timed with tracemalloc on, which slows the phases that '
+                         'allocate the most)')
+            lines.append('{:<22}{:>10}{:>12}{:>12}'.format('phase', 'seconds', 'net MB',
+                                                          'peak MB'))
+            for name, phase in self.phases.items():
+                lines.append('{:<22}{:>10.3f}{:>12.1f}{:>12.1f}'.format(
+                    name, phase['seconds'], phase['net_bytes'] / 2 ** 20,
+                    phase['peak_bytes'] / 2 ** 20))
+        else:
+            lines.append('{:<22}{:>10}'.format('phase', 'seconds'))
+            for name, phase in self.phases.items():
+                lines.append('{:<22}{:>10.3f}'.format(name, phase['seconds']))
+        lines.append('{:<22}{:>10.3f}'.format(
+            'total', sum(phase['seconds'] for phase in self.phases.values())))
+        lines.append('{:<22}{:>10.3f}'.format('profiler overhead', self.overhead))
+        for name, rows in self.counters.items():
+            lines.append('{:<22}{:>10}'.format(name, rows))
+        return '\n'.join(lines)
+
+    def prometheus(self):
+        """Returns the phases and counters in the Prometheus text format (for
+           the node exporter's textfile collector)."""
+
+        metrics = [('phase_seconds', 'seconds', 'Wall time of the phase.')]
+        if self.trace_memory:
+            metrics += [('phase_net_bytes', 'net_bytes', 'Bytes the phase left allocated.'),
+                        ('phase_peak_bytes', 'peak_bytes', 'Peak bytes allocated in the phase.')]
+
+        lines = []
+        for metric, key, description in metrics:
+            lines.append('# HELP border_crossing_{} {}'.format(metric, description))
+            lines.append('# TYPE border_crossing_{} gauge'.format(metric))
+            for name, phase in self.phases.items():
+                lines.append('border_crossing_{}{{script="{}",phase="{}"}} {}'.format(
+                    metric, self.script, name, phase[key]))
+
+        lines.append('# HELP border_crossing_profiler_overhead_seconds Time the profiler '
+                     'spent on its own bookkeeping.')
+        lines.append('# TYPE border_crossing_profiler_overhead_seconds gauge')
+        lines.append('border_crossing_profiler_overhead_seconds{{script="{}"}} {}'.format(
+            self.script, self.overhead))
+
+        lines.append('# HELP border_crossing_rows Rows handled by the run.')
+        lines.append('# TYPE border_crossing_rows gauge')
+        for name, rows in self.counters.items():
+            lines.append('border_crossing_rows{{script="{}",counter="{}"}} {}'.format(
+                self.script, name, rows))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,166 @@
+"""Importable API of the border crossing statistics, for Python code that
+   wants the report rows in process instead of running a script and reading
+   its output file back in.
+
+       from report import BorderCrossingReport
+
+       with open('Border_Crossing_Entry_Data.csv', newline='') as csv_file:
+           for border, date, measure, value, average in BorderCrossingReport(
+                   csv_file, engine='nested-dict', since='2010-01'):
+               ...
+"""
+
+import io
+import csv
+
+from collections.abc import Mapping
+
+from utils import DateIndex, RecordFilter, parse_month, calculate_running_average
+from utils import sort_report, parse_value
+
+
+class BorderCrossingReport:
+    """
+    Report of the border crossing entry data, computed lazily by one of the
+    engines of the scripts when it is iterated over:
+
+        sorted-groupby  sorts and groups the rows (border_crossing_statistics.py)
+        nested-dict     adds the rows into a store of sums keyed by Border,
+                        Measure, and Date (border_crossing_statistics_optimized.py)
+        sql             aggregates and averages the rows in an in-memory SQLite
+                        database (SQL_border_crossing_statistics.py), which
+                        breaks ties between borders in ascending order
+
+    The rows are yielded as (Border, Date, Measure, Value, Average) tuples,
+    ordered by Date, Value, Measure, and Border in descending order. A file
+    object or an iterator can only be read once, so neither can a report of it.
+    """
+
+    ENGINES = ('sorted-groupby', 'nested-dict', 'sql')
+
+    def __init__(self, source, engine='sorted-groupby', borders=None, measures=None,
+                 since=None, until=None, top=None, memory_budget=None):
+        """
+        Args:
+            source: a csv file object of the border crossing entry data (text
+                    or binary, with its header), or an iterable of rows, each a
+                    (Border, Date, Measure, Value) sequence or a mapping with
+                    those keys (e.g. a csv.DictReader)
+            engine: one of ENGINES
+            borders: only report these borders (all by default)
+            measures: only report these measures (all by default)
+            since: first month to report, as YYYY-MM or an ordinal month
+            until: last month to report, as YYYY-MM or an ordinal month
+            top: number of rows to report (all rows by default)
+            memory_budget: bytes of rows (or keys) to hold in memory, past which
+                           they are spilled to temporary files (not with sql)
+
+        Raises:
+            ValueError: if the engine is not known, top is not positive, or the
+                        options do not go with the engine
+        """
+        if engine not in self.ENGINES:
+            raise ValueError('engine must be one of {}'.format(', '.join(self.ENGINES)))
+        if top is not None and top < 1:
+            raise ValueError('top must be positive')
+        if engine == 'sql' and memory_budget is not None:
+            raise ValueError('the sql engine does not take a memory budget')
+
+        self.source = source
+        self.engine = engine
+        self.since = parse_month(since) if isinstance(since, str) else since
+        self.top = top
+        self.memory_budget = memory_budget
+
+        # The months before since are still needed for the running averages,
+        # so only the borders, measures, and later months are filtered out
+        self.record_filter = RecordFilter(
+            [borders] if isinstance(borders, str) else borders,
+            [measures] if isinstance(measures, str) else measures,
+            parse_month(until) if isinstance(until, str) else until)
+
+    def __iter__(self):
+        return self.rows()
+
+    def records(self):
+        """Generator of the (Border, Date, Measure, Value) records of the source."""
+
+        source = self.source
+        if isinstance(source, (io.RawIOBase, io.BufferedIOBase)):
+            source = io.TextIOWrapper(source, newline='')
+
+        # A csv file: find the columns by their names in the header
+        if hasattr(source, 'read'):
+            csv_reader = csv.reader(source, delimiter=',')
+            header = next(csv_reader, None)
+            if header is None:
+                return
+            border, date, measure, value = (header.index(column) for column in
+                                            ('Border', 'Date', 'Measure', 'Value'))
+            for row in csv_reader:
+                yield row[border], row[date], row[measure], parse_value(row[value])
+            return
+
+        # The Values are parsed the same way as the csv files' (an empty or
+        # non-numeric Value is 0)
+        for row in source:
+            if isinstance(row, Mapping):
+                yield row['Border'], row['Date'], row['Measure'], parse_value(row['Value'])
+            else:
+                yield row[0], row[1], row[2], parse_value(row[3])
+
+    def rows(self):
+        """Generator of the report rows (see the class docstring).
+
+        Yields:
+            row (tuple): (<Border>, <Date>, <Measure>, <Value>, <Average>)
+        """
+
+        records = self.record_filter(self.records())
+        if self.engine == 'sorted-groupby':
+            report = self._sorted_groupby_report(records)
+        elif self.engine == 'nested-dict':
+            report = self._nested_dict_report(records)
+        else:
+            report = self._sql_report(records)
+
+        for row in report:
+            yield tuple(row)
+
+    def _sorted_groupby_report(self, records):
+        from border_crossing_statistics import read_and_aggregate
+
+        date_index = DateIndex()
+        list_with_agg_values = read_and_aggregate(records, memory_budget=self.memory_budget)
+        list_with_avg = calculate_running_average(list_with_agg_values, date_index)
+        return sort_report(list_with_avg, date_index, self.since, self.top,
+                           self.memory_budget)
+
+    def _nested_dict_report(self, records):
+        from optimized_engine import CrossingTotals, find_average
+
+        if self.memory_budget is None:
+            result = CrossingTotals()
+        else:
+            from external_sort import SpillingTotals
+            result = SpillingTotals(self.memory_budget)
+        for border, date, measure, value in records:
+            result.add(border, measure, date, value)
+        return find_average(result, self.since, self.top, self.memory_budget)
+
+    def _sql_report(self, records):
+        import sqlite3
+        from sql_engine import CREATE_CROSSINGS_TABLE, CREATE_CROSSINGS_INDEX
+        from sql_engine import load_bct_table, report_query, restore_dates
+
+        connection = sqlite3.connect(':memory:')
+        try:
+            date_index = DateIndex()
+            load_bct_table(connection, records, date_index)
+            connection.execute(CREATE_CROSSINGS_TABLE)
+            connection.execute(CREATE_CROSSINGS_INDEX)
+
+            query, parameters = report_query(self.since, self.top)
+            yield from restore_dates(connection.execute(query, parameters), date_index)
+        finally:
+            connection.close()
@@ -0,0 +1,220 @@
+"""Prefix sum index of each Border and Measure, behind the report server
+   (serve.py) and the trailing averages (--windows)."""
+
+import os
+import bisect
+
+from array import array
+
+from utils import my_round, DateIndex, input_records
+from optimized_engine import CrossingTotals
+
+
+class SeriesIndex:
+    """
+    In-memory index of the crossings, built once. Each (border, measure)
+    series keeps its months in chronological order next to arrays of the
+    monthly sums and their prefix sums, so the total and the running
+    average of any range of months is two binary searches and a subtraction.
+
+    For the trailing averages it also keeps prefix sums (and prefix counts
+    of the months that have data) over every calendar month from its first
+    to its last, so the average of any window is O(1).
+    """
+    __slots__ = ('_series', '_calendar', 'filename', 'stamp')
+
+    def __init__(self, series, filename=None, stamp=None):
+        self._series = dict()
+        self._calendar = dict()
+        self.filename = filename
+        self.stamp = stamp
+        date_index = DateIndex()
+
+        for key, measure_values in series.items():
+
+            # Sort the months of the series chronologically
+            dates = sorted(measure_values, key=date_index.__getitem__)
+            months = array('l', map(date_index.__getitem__, dates))
+            sums = array('q', map(measure_values.__getitem__, dates))
+
+            # prefix[i] is the sum of the first i months
+            prefix = array('q', [0])
+            for value in sums:
+                prefix.append(prefix[-1] + value)
+
+            self._series[key] = (dates, months, sums, prefix)
+
+            # The same prefix sums, but over every calendar month, with
+            # calendar_counts[i] the number of the first i months with data
+            first = months[0]
+            span = months[-1] - first + 1
+            calendar_sums = array('q', bytes(8 * span))
+            calendar_counts = array('l', [0]) * (span + 1)
+            for month, value in zip(months, sums):
+                calendar_sums[month - first] = value
+                calendar_counts[month - first + 1] = 1
+
+            calendar_prefix = array('q', [0])
+            for i, value in enumerate(calendar_sums):
+                calendar_prefix.append(calendar_prefix[-1] + value)
+                calendar_counts[i + 1] += calendar_counts[i]
+
+            self._calendar[key] = (first, calendar_prefix, calendar_counts)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds the index from aggregated (Border, Date, Measure, Value) rows.
+        """
+        series = dict()
+        for border, date, measure, value, *_ in rows:
+            series.setdefault((border, measure), {})[date] = value
+        return cls(series)
+
+    @classmethod
+    def load(cls, filename, use_mmap=False, use_cache=False):
+        """
+        Reads and aggregates the input file into a new index, and remembers
+        the size and modification time of the file it was loaded from.
+        """
+        stat = os.stat(filename)
+        totals = CrossingTotals()
+        for border, date, measure, value in input_records(filename, use_mmap, use_cache):
+            totals.add(border, measure, date, value)
+        return cls(totals.series(), filename, (stat.st_size, stat.st_mtime_ns))
+
+    def is_stale(self):
+        """
+        Checks whether the input file changed since the index was loaded.
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) != self.stamp
+
+    def keys(self):
+        """
+        Returns the (border, measure) keys of the series, sorted.
+        """
+        return sorted(self._series)
+
+    def _range(self, border, measure, since=None, until=None):
+        """
+        Finds the series and the [start, end) slots of its months between
+        since and until (ordinal months, both inclusive).
+        """
+        series = self._series.get((border, measure))
+        if series is None:
+            raise KeyError((border, measure))
+        months = series[1]
+        start = 0 if since is None else bisect.bisect_left(months, since)
+        end = len(months) if until is None else bisect.bisect_right(months, until)
+        return series, start, max(start, end)
+
+    def summary(self, border, measure, since=None, until=None):
+        """Sums the months of a series between since and until in O(log n).
+
+        Args:
+            border: the Border of the series
+            measure: the Measure of the series
+            since: first ordinal month (the first month of the series by default)
+            until: last ordinal month (the last month of the series by default)
+
+        Returns:
+            summary (dict): the number of months, the total, the average of
+                            the months in the range, and the running average
+                            (of all the earlier months) of its last month
+
+        Raises:
+            KeyError: if there is no such series
+        """
+
+        (dates, months, sums, prefix), start, end = self._range(border, measure,
+                                                                since, until)
+        count = end - start
+        total = prefix[end] - prefix[start]
+        return {'border': border, 'measure': measure,
+                'first': dates[start] if count else None,
+                'last': dates[end - 1] if count else None,
+                'months': count, 'total': total,
+                'average': my_round(total / count) if count else 0,
+                'running_average': (my_round(prefix[end - 1] / (end - 1))
+                                    if end > 1 and count else 0)}
+
+    def rows(self, border, measure, since=None, until=None):
+        """Returns the report rows of a series between since and until, most
+           recent first.
+
+        Args:
+            border: the Border of the series
+            measure: the Measure of the series
+            since: first ordinal month (the first month of the series by default)
+            until: last ordinal month (the last month of the series by default)
+
+        Returns:
+            rows (list): (<Border>, <Date>, <Measure>, <Value>, <Average>) rows
+
+        Raises:
+            KeyError: if there is no such series
+        """
+
+        (dates, months, sums, prefix), start, end = self._range(border, measure,
+                                                                since, until)
+        return [(border, dates[i], measure, sums[i],
+                 my_round(prefix[i] / i) if i else 0)
+                for i in range(end - 1, start - 1, -1)]
+
+    def window_columns(self, border, measure, month, windows):
+        """Finds the trailing averages and the year over year delta of one
+           month of a series, in O(1) per window.
+
+        Args:
+            border: the Border of the series
+            measure: the Measure of the series
+            month: the ordinal month (which has data)
+            windows: the window lengths in months
+
+        Returns:
+            columns (list): the average of the months with data among the N
+                            calendar months before this one, for each window
+                            N (0 if there are none), then the change from
+                            the same month a year earlier (None if that
+                            month has no data)
+        """
+
+        first, prefix, counts = self._calendar[(border, measure)]
+        end = month - first
+
+        columns = []
+        for window in windows:
+            start = max(end - window, 0)
+            count = counts[end] - counts[start]
+            columns.append(my_round((prefix[end] - prefix[start]) / count) if count else 0)
+
+        # The same month a year earlier, if the series has data for it
+        last_year = end - 12
+        if last_year >= 0 and counts[last_year + 1] - counts[last_year]:
+            columns.append((prefix[end + 1] - prefix[end]) -
+                           (prefix[last_year + 1] - prefix[last_year]))
+        else:
+            columns.append(None)
+        return columns
+
+
+def add_window_columns(final_list, index, windows, date_index):
+    """Adds the trailing average and year over year delta columns to the
+       report rows (see SeriesIndex.window_columns).
+
+    Args:
+        final_list: the report rows (<Border>, <Date>, <Measure>, <Value>, <Average>)
+        index: SeriesIndex of all the aggregated rows
+        windows: the window lengths in months
+        date_index: DateIndex mapping each date to its ordinal month
+
+    Returns:
+        final_list (list): the report rows with the new columns
+    """
+
+    return [list(row) + index.window_columns(row[0], row[2], date_index[row[1]], windows)
+            for row in final_list]
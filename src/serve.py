@@ -0,0 +1,118 @@
+"""This script serves the border crossing statistics over a local HTTP/JSON API.
+   The input file is read and aggregated once into an index of each Border
+   and Measure (see series_index.SeriesIndex), and is reloaded when it changes."""
+
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from utils import parse_args, check_flags, parse_month
+from series_index import SeriesIndex
+
+# The flags of utils.parse_args this script supports (the others are rejected)
+SUPPORTED_FLAGS = {'input', 'mmap', 'cache', 'host', 'port'}
+
+
+class ReportServer(ThreadingHTTPServer):
+    """
+    HTTP server that holds the index of the input file. Before a request is
+    answered the input file is checked, and if it changed one request
+    thread reloads the index while the others keep answering from the old
+    one.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, index, use_mmap=False, use_cache=False):
+        super().__init__(address, ReportRequestHandler)
+        self.index = index
+        self.use_mmap = use_mmap
+        self.use_cache = use_cache
+        self._reloading = threading.Lock()
+
+    def current_index(self):
+        """Returns the index, reloading it first if the input file changed."""
+
+        index = self.index
+        if index.is_stale() and self._reloading.acquire(blocking=False):
+            try:
+                self.index = SeriesIndex.load(index.filename, self.use_mmap,
+                                              self.use_cache)
+            finally:
+                self._reloading.release()
+        return self.index
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers the GET requests of the API:
+
+        /series                                  the (Border, Measure) keys
+        /summary?border=&measure=&since=&until=  total and averages of a range
+        /rows?border=&measure=&since=&until=     report rows of a range
+
+    since and until are optional months (YYYY-MM).
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        index = self.server.current_index()
+
+        if url.path == '/series':
+            return self.send_json(200, [{'border': border, 'measure': measure}
+                                        for border, measure in index.keys()])
+        if url.path not in ('/summary', '/rows'):
+            return self.send_json(404, {'error': 'unknown path %s' % url.path})
+
+        try:
+            border, measure = query['border'], query['measure']
+            since = parse_month(query['since']) if 'since' in query else None
+            until = parse_month(query['until']) if 'until' in query else None
+        except (KeyError, ValueError) as error:
+            return self.send_json(400, {'error': 'bad query: %s' % error})
+
+        try:
+            if url.path == '/summary':
+                return self.send_json(200, index.summary(border, measure, since, until))
+            return self.send_json(200, [dict(zip(('border', 'date', 'measure', 'value',
+                                                  'average'), row))
+                                        for row in index.rows(border, measure,
+                                                              since, until)])
+        except KeyError:
+            return self.send_json(404, {'error': 'no series for %s, %s' % (border, measure)})
+
+    def send_json(self, status, body):
+        """Writes the body out as a JSON response."""
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    """Loads the specified border crossing entry data (input file) and serves
+       its statistics until interrupted. """
+
+    # Input file Error-Handling
+    args = parse_args()
+    if args.input is None:
+        raise ImportError('Did not specify the correct input file!')
+    check_flags(args, 'serve.py', SUPPORTED_FLAGS)
+
+    index = SeriesIndex.load(args.input, args.mmap, args.cache)
+    server = ReportServer((args.host, args.port), index, args.mmap, args.cache)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
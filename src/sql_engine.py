@@ -0,0 +1,242 @@
+"""Queries and helpers of the SQL script (SQL_border_crossing_statistics.py):
+   the in-memory report and the on-disk warehouse (--db)."""
+
+# The aggregated Border, Date, Measure, and Total Sum Value of the crossings,
+# kept in a table (instead of a subquery) so it can be indexed
+CREATE_CROSSINGS_TABLE = ("CREATE TABLE crossings AS "
+                          "SELECT Border, Date, Measure, SUM(Value) AS SumField "
+                          "FROM bct "
+                          "GROUP BY Border, Date, Measure")
+
+# Covering index, so each Border and Measure can be read in Date order
+# (with its SumField) without touching the table
+CREATE_CROSSINGS_INDEX = ("CREATE INDEX crossings_series "
+                          "ON crossings (Border, Measure, Date, SumField)")
+
+# The average of all the months before the current one of each Border and
+# Measure, as a window over the rows before it (0 if it is the first month)
+REPORT_AVERAGES = ("SELECT Border, Date, Measure, SumField, "
+                   "ifnull(cast(round(avg(SumField) OVER ("
+                   "PARTITION BY Border, Measure ORDER BY Date "
+                   "ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS INTEGER), 0) "
+                   "AS Average{} "
+                   "FROM crossings")
+REPORT_ORDER = " ORDER BY Date DESC, SumField DESC, Border, Measure DESC"
+REPORT_QUERY = REPORT_AVERAGES.format('') + REPORT_ORDER
+
+# The trailing average of the N calendar months before the current one (the
+# dates are ordinal month numbers, so a RANGE frame skips the missing
+# months), and the change from the same month a year earlier
+WINDOW_AVERAGE = (", ifnull(cast(round(avg(SumField) OVER ("
+                  "PARTITION BY Border, Measure ORDER BY Date "
+                  "RANGE BETWEEN {0} PRECEDING AND 1 PRECEDING), 0) AS INTEGER), 0) "
+                  "AS Average_{0}M")
+YOY_DELTA = (", SumField - sum(SumField) OVER ("
+             "PARTITION BY Border, Measure ORDER BY Date "
+             "RANGE BETWEEN 12 PRECEDING AND 12 PRECEDING) AS YoY_Delta")
+
+
+def report_query(since=None, top=None, windows=None):
+    """Builds the report query, with the months before since dropped (after
+       their running averages are taken) and only the top rows kept.
+
+    Args:
+        since: first ordinal month to report (all months by default)
+        top: number of rows to report (all rows by default)
+        windows: trailing average windows to add (see --windows)
+
+    Returns:
+        query (str): the SQL query
+        parameters (list): its parameters
+    """
+
+    columns = ''
+    if windows:
+        columns = ''.join(WINDOW_AVERAGE.format(window) for window in windows) + YOY_DELTA
+
+    if since is None and top is None:
+        return REPORT_AVERAGES.format(columns) + REPORT_ORDER, []
+
+    # Filter and limit the report after the window has seen every month
+    query = "SELECT * FROM (" + REPORT_AVERAGES.format(columns) + ")"
+    parameters = []
+    if since is not None:
+        query += " WHERE Date >= ?"
+        parameters.append(since)
+    query += REPORT_ORDER
+    if top is not None:
+        query += " LIMIT ?"
+        parameters.append(top)
+    return query, parameters
+
+
+def load_bct_table(connection, records, date_index):
+    """Bulk loads the records into the bct table of a SQLite database, in one
+       transaction with the journal and syncing turned off. The dates are
+       stored as their ordinal month numbers, which sort correctly.
+
+    Args:
+        connection: sqlite3 connection
+        records: iterable of (Border, Date, Measure, Value) records
+        date_index: DateIndex mapping each date to its ordinal month
+    """
+
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+
+    with connection:
+        connection.execute("CREATE TABLE bct (Border TEXT, Date INTEGER, Measure TEXT, "
+                           "Value INTEGER)")
+        connection.executemany("INSERT INTO bct VALUES (?, ?, ?, ?)",
+                               ((border, date_index[date], measure, value)
+                                for border, date, measure, value in records))
+
+
+def restore_dates(rows, date_index):
+    """Turns the ordinal month numbers of the report rows back into the
+       original date strings.
+
+    Args:
+        rows: iterable of (Border, Date, Measure, Value, Average, ...) rows
+        date_index: DateIndex the dates were loaded with
+
+    Yields:
+        row (list): the report row with its original date string
+    """
+
+    dates = {month: date for date, month in date_index.items()}
+    for border, month, *columns in rows:
+        yield [border, dates[month]] + columns
+
+
+# Tables of the on-disk warehouse (--db). The raw rows are kept once per
+# Port Code, Date, and Measure, and the crossings keep their Average, so a
+# report is a single read of the crossings table
+WAREHOUSE_SCHEMA = ("CREATE TABLE IF NOT EXISTS bct ("
+                    "PortCode TEXT, Border TEXT, Date INTEGER, Measure TEXT, Value INTEGER, "
+                    "PRIMARY KEY (PortCode, Date, Measure)) WITHOUT ROWID",
+                    "CREATE TABLE IF NOT EXISTS crossings ("
+                    "Border TEXT, Date INTEGER, Measure TEXT, SumField INTEGER, "
+                    "Average INTEGER, PRIMARY KEY (Border, Measure, Date)) WITHOUT ROWID",
+                    "CREATE INDEX IF NOT EXISTS crossings_report "
+                    "ON crossings (Date, SumField)",
+                    "CREATE TABLE IF NOT EXISTS dates ("
+                    "Date INTEGER PRIMARY KEY, Original TEXT)")
+
+
+def ingest_into_warehouse(connection, records, date_index):
+    """Adds the rows of the input file whose Port Code, Date, and Measure are
+       not in the warehouse yet, then updates only the crossings they change:
+       their Total Sum Value, and the Average of their month and every later
+       month of the same Border and Measure.
+
+    Args:
+        connection: sqlite3 connection to the warehouse
+        records: iterable of (Port Code, Border, Date, Measure, Value) records
+        date_index: DateIndex mapping each date to its ordinal month
+
+    Returns:
+        new_rows (int): the number of rows added to the warehouse
+    """
+
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+    with connection:
+        for statement in WAREHOUSE_SCHEMA:
+            connection.execute(statement)
+
+        # Sum the input file's rows of each Port Code, Date, and Measure, and
+        # keep the ones the warehouse does not have yet
+        connection.execute("CREATE TEMP TABLE incoming ("
+                           "PortCode TEXT, Border TEXT, Date INTEGER, Measure TEXT, "
+                           "Value INTEGER)")
+        connection.executemany("INSERT INTO incoming VALUES (?, ?, ?, ?, ?)",
+                               ((port_code, border, date_index[date], measure, value)
+                                for port_code, border, date, measure, value in records))
+        connection.execute("CREATE TEMP TABLE new_rows AS "
+                           "SELECT PortCode, Border, Date, Measure, SUM(Value) AS Value "
+                           "FROM incoming AS i "
+                           "WHERE NOT EXISTS (SELECT 1 FROM bct AS b "
+                           "WHERE b.PortCode = i.PortCode AND b.Date = i.Date "
+                           "AND b.Measure = i.Measure) "
+                           "GROUP BY PortCode, Date, Measure")
+        connection.execute("DROP TABLE incoming")
+        connection.execute("INSERT INTO bct SELECT * FROM new_rows")
+
+        connection.executemany("INSERT OR IGNORE INTO dates VALUES (?, ?)",
+                               ((month, date) for date, month in date_index.items()))
+
+        # Add the new rows to the Total Sum Value of their crossings
+        connection.execute("INSERT INTO crossings "
+                           "SELECT Border, Date, Measure, SUM(Value), 0 FROM new_rows "
+                           "WHERE true GROUP BY Border, Date, Measure "
+                           "ON CONFLICT (Border, Measure, Date) "
+                           "DO UPDATE SET SumField = SumField + excluded.SumField")
+
+        # Recalculate the Average from the first changed month of each
+        # changed Border and Measure onwards
+        connection.execute("WITH changed AS ("
+                           "SELECT Border, Measure, MIN(Date) AS FirstDate "
+                           "FROM new_rows GROUP BY Border, Measure), "
+                           "averages AS ("
+                           "SELECT c.Border, c.Measure, c.Date, changed.FirstDate, "
+                           "ifnull(cast(round(avg(c.SumField) OVER ("
+                           "PARTITION BY c.Border, c.Measure ORDER BY c.Date "
+                           "ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) "
+                           "AS INTEGER), 0) AS Average "
+                           "FROM crossings AS c JOIN changed "
+                           "ON c.Border = changed.Border AND c.Measure = changed.Measure) "
+                           "UPDATE crossings SET Average = averages.Average FROM averages "
+                           "WHERE crossings.Border = averages.Border "
+                           "AND crossings.Measure = averages.Measure "
+                           "AND crossings.Date = averages.Date "
+                           "AND averages.Date >= averages.FirstDate")
+
+        new_rows = connection.execute("SELECT count(*) FROM new_rows").fetchone()[0]
+        connection.execute("DROP TABLE new_rows")
+
+    return new_rows
+
+
+def warehouse_report(connection, record_filter=None, since=None, top=None):
+    """Reads the report out of the warehouse's crossings table. The running
+       averages are kept up to date on ingest, so the filters only have to
+       pick the rows.
+
+    Args:
+        connection: sqlite3 connection to the warehouse
+        record_filter: RecordFilter of the borders, measures, and months to
+                       report (all of them by default)
+        since: first ordinal month to report (all months by default)
+        top: number of rows to report (all rows by default)
+
+    Returns:
+        rows: cursor of (Border, Date, Measure, Value, Average) rows, with
+              the original date strings
+    """
+
+    conditions, parameters = [], []
+    if record_filter and record_filter.borders is not None:
+        conditions.append("c.Border IN (%s)" % ", ".join("?" * len(record_filter.borders)))
+        parameters += sorted(record_filter.borders)
+    if record_filter and record_filter.measures is not None:
+        conditions.append("c.Measure IN (%s)" % ", ".join("?" * len(record_filter.measures)))
+        parameters += sorted(record_filter.measures)
+    if record_filter and record_filter.until is not None:
+        conditions.append("c.Date <= ?")
+        parameters.append(record_filter.until)
+    if since is not None:
+        conditions.append("c.Date >= ?")
+        parameters.append(since)
+
+    query = ("SELECT c.Border, d.Original, c.Measure, c.SumField, c.Average "
+             "FROM crossings AS c JOIN dates AS d ON c.Date = d.Date ")
+    if conditions:
+        query += "WHERE " + " AND ".join(conditions) + " "
+    query += "ORDER BY c.Date DESC, c.SumField DESC, c.Border, c.Measure DESC"
+    if top is not None:
+        query += " LIMIT ?"
+        parameters.append(top)
+
+    return connection.execute(query, parameters)
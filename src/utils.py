@@ -1,17 +1,22 @@
 """Script contain helper functions for border crossing analysis. """
 
-# Packages to import
+# Packages to import. Only the ones every run needs are imported here: the
+# engine specific helpers live in their own modules (numpy_engine, sql_engine,
+# optimized_engine, series_index, pipeline, input_cache, compression, and
+# profiler), which are imported only by the paths that use them
 import math
-import pandas as pd
-import pathlib
+import io
+import heapq
 import errno
 import csv
 import os
+import sys
+import mmap
 import argparse
 
 from operator import itemgetter
 from datetime import datetime
-from itertools import chain
+from itertools import islice
 
 
 def my_round(my_number):
@@ -28,19 +33,266 @@ def my_round(my_number):
     return f if my_number - f < 0.5 else f+1
 
 
-def parse_args():
-    """Parses arguments passed in the shell to be used in the main function.
+def parse_month(text):
+    """Turns a YYYY-MM month into its ordinal month number (see DateIndex).
+
+    Args:
+        text: the month, e.g. 2019-03
 
     Returns:
-        args -- arguments
+        ordinal (int): year * 12 + month - 1
+    """
+    date = datetime.strptime(text, '%Y-%m')
+    return date.year * 12 + date.month - 1
+
+
+def parse_windows(text):
+    """Turns a comma separated list of window lengths into a list of ints.
+
+    Args:
+        text: the window lengths in months, e.g. 3,6,12
+
+    Returns:
+        windows (list): the window lengths
+    """
+
+    windows = [int(window) for window in text.split(',')]
+    if any(window < 1 for window in windows):
+        raise ValueError('window lengths must be positive')
+    return windows
+
+
+def parse_positive_int(text):
+    """Turns a count, such as the K of --top K, into an int.
+
+    Args:
+        text: the count, e.g. 10
+
+    Returns:
+        count (int): the count, at least 1
+    """
+
+    count = int(text)
+    if count < 1:
+        raise ValueError('counts must be positive')
+    return count
+
+
+def parse_size(text):
+    """Turns a size in bytes, with an optional K, M, or G suffix, into an int.
+
+    Args:
+        text: the size, e.g. 512M or 2G
+
+    Returns:
+        size (int): the number of bytes
+    """
+
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        size = int(float(text[:-1]) * units[text[-1]])
+    else:
+        size = int(text)
+    if size < 1:
+        raise ValueError('sizes must be positive')
+    return size
+
+
+def argument_parser():
+    """Builds the parser of the arguments shared by all of the scripts. Each
+       script only supports some of them (see check_flags).
+
+    Returns:
+        parser -- argparse.ArgumentParser
     """
     parser = argparse.ArgumentParser(description='Look for Border Crossing Statistics')
     parser.add_argument('--input', help="enter the input filename", type=str)
     parser.add_argument('--output', help="enter the output filename", type=str)
-    args = parser.parse_args()
+    parser.add_argument('--stream', help="aggregate the rows one at a time instead of "
+                                         "sorting the whole input file",
+                        action='store_true')
+    parser.add_argument('--workers', help="number of processes to parse and aggregate "
+                                          "the input file with", type=int, default=1)
+    parser.add_argument('--mmap', help="scan a memory map of the input file and decode "
+                                       "only the Border, Date, Measure, and Value columns",
+                        action='store_true')
+    parser.add_argument('--cache', help="read the input file through a binary column "
+                                        "cache next to it (built on the first run)",
+                        action='store_true')
+    parser.add_argument('--engine', help="python (default) or numpy, which aggregates and "
+                                         "averages with vectorized array operations",
+                        choices=['python', 'numpy'], default='python')
+    parser.add_argument('--db', help="SQLite warehouse file to keep the data in between "
+                                     "runs (only new rows are added)", type=str)
+    parser.add_argument('--state', help="file to keep the aggregate state in between "
+                                        "runs", type=str)
+    parser.add_argument('--append', help="add the input file to the aggregate state and "
+                                         "output only the report rows that changed",
+                        action='store_true')
+    parser.add_argument('--border', help="only report this border (can be repeated)",
+                        action='append')
+    parser.add_argument('--measure', help="only report this measure (can be repeated)",
+                        action='append')
+    parser.add_argument('--since', help="only report the months from this one (YYYY-MM) on",
+                        type=parse_month)
+    parser.add_argument('--until', help="only report the months up to this one (YYYY-MM)",
+                        type=parse_month)
+    parser.add_argument('--top', help="only report the K most recent (and largest) rows",
+                        type=parse_positive_int)
+    parser.add_argument('--pipeline', help="overlap reading, aggregating, and writing "
+                                           "in an asyncio pipeline", action='store_true')
+    parser.add_argument('--decompress-thread', help="decompress a .gz, .bz2, .xz, or .zip "
+                                                    "input file in a background thread",
+                        action='store_true')
+    parser.add_argument('--windows', help="add trailing averages over these numbers of "
+                                          "months (e.g. 3,6,12) and the year over year delta",
+                        type=parse_windows)
+    parser.add_argument('--profile', help="time each phase, count its rows, "
+                                          "and print a summary table", action='store_true')
+    parser.add_argument('--profile-memory', help="with --profile, also trace the memory each "
+                                                 "phase allocates (slows the run down)",
+                        action='store_true')
+    parser.add_argument('--profile-dir', help="with --profile, dump a cProfile of each phase "
+                                              "into this directory")
+    parser.add_argument('--metrics', help="with --profile, write the metrics to this file "
+                                          "(Prometheus textfile if it ends in .prom, "
+                                          "otherwise JSON)")
+    parser.add_argument('--memory-budget', help="memory (e.g. 512M or 2G) to sort the input "
+                                                "rows (or, with --stream and the optimized "
+                                                "script, aggregate their keys) in before "
+                                                "spilling to temporary files",
+                        type=parse_size)
+    parser.add_argument('--host', help="address the report server listens on",
+                        default='127.0.0.1')
+    parser.add_argument('--port', help="port the report server listens on",
+                        type=int, default=8000)
+    return parser
+
+
+def parse_args():
+    """Parses arguments passed in the shell to be used in the main function.
+
+    Returns:
+        args -- arguments
+    """
+    args = argument_parser().parse_args()
     return args
 
 
+def check_flags(args, script, supported):
+    """Rejects the flags the script does not support, instead of silently
+       ignoring them (e.g. --db given to border_crossing_statistics.py).
+
+    Args:
+        args: arguments returned by parse_args
+        script: name of the script, for the error message
+        supported: names (args attributes) of the flags the script supports
+
+    Raises:
+        ImportError: if a flag the script does not support was given
+    """
+    defaults = argument_parser().parse_args([])
+    given = ['--' + name.replace('_', '-') for name, value in vars(args).items()
+             if name not in supported and value != getattr(defaults, name)]
+    if given:
+        raise ImportError('{} does not support {}!'.format(script, ', '.join(given)))
+
+
+class DateIndex(dict):
+    """Interns the date strings of the border crossing data. Each distinct
+       date string is parsed only once (the first time it is looked up) and
+       mapped to an ordinal month number, so the rows can be sorted on
+       integers instead of calling datetime.strptime for every row.
+
+       For example, '03/01/2019 12:00:00 AM' --> 2019 * 12 + 2 = 24230
+    """
+
+    # The dates in the data are month first, e.g. 03/01/2019 12:00:00 AM
+    date_format = '%m/%d/%Y %I:%M:%S %p'
+
+    def __missing__(self, date_string):
+        date = datetime.strptime(date_string, self.date_format)
+        ordinal = date.year * 12 + date.month - 1
+        self[date_string] = ordinal
+        return ordinal
+
+
+class RecordFilter:
+    """Skips the records of the borders, measures, and months that are not
+       asked for while they are read in, before they are aggregated. The
+       months before --since are kept, since the running averages of the
+       months that are reported depend on them (see sort_report).
+    """
+
+    def __init__(self, borders=None, measures=None, until=None):
+        self.borders = set(borders) if borders else None
+        self.measures = set(measures) if measures else None
+        self.until = until
+
+    def __bool__(self):
+        return bool(self.borders or self.measures or self.until is not None)
+
+    def __call__(self, records):
+        """Returns the records that pass the filter (all of them if there
+           is nothing to filter on)."""
+        if not self:
+            return records
+        return self.filtered(records)
+
+    def filtered(self, records):
+        borders, measures, until = self.borders, self.measures, self.until
+        date_index = DateIndex()
+        for record in records:
+            if borders is not None and record[0] not in borders:
+                continue
+            if measures is not None and record[2] not in measures:
+                continue
+            if until is not None and date_index[record[1]] > until:
+                continue
+            yield record
+
+
+def sort_report(list_with_avg, date_index, since=None, top=None, memory_budget=None):
+    """Sorts the report rows by Date, Value, Measure, and Border in descending
+       order, after dropping the months before since. If only the top rows
+       are asked for, a bounded heap picks them instead of a full sort.
+
+    Args:
+        list_with_avg: the report rows (<Border>, <Date>, <Measure>, <Value>, <Average>)
+        date_index: DateIndex mapping each date to its ordinal month
+        since: first ordinal month to report (all months by default)
+        top: number of rows to report (all rows by default)
+        memory_budget: if given (and not top), the bytes of rows to sort in
+                       memory at a time (see external_sort.external_sorted)
+
+    Returns:
+        final_sorted_list (list): the sorted report rows (an iterator of
+                                  them if sorted through temporary files)
+    """
+
+    if memory_budget is not None and top is None:
+
+        # Only imported when it is asked for, since tempfile is slow to import
+        from external_sort import external_sorted
+        if since is not None:
+            list_with_avg = (row for row in list_with_avg if date_index[row[1]] >= since)
+        return external_sorted(list_with_avg,
+                               lambda x: (date_index[x[1]], x[3], x[2], x[0]),
+                               memory_budget, reverse=True)
+
+    if since is not None:
+        list_with_avg = [row for row in list_with_avg if date_index[row[1]] >= since]
+
+    if top is not None:
+        return heapq.nlargest(top, list_with_avg,
+                              key=lambda x: (date_index[x[1]], x[3], x[2], x[0]))
+
+    # Sort the list by Value, Measure, Border and then (stable) by Date
+    sorted_list_with_vbm = sorted(list_with_avg, key=itemgetter(3, 2, 0), reverse=True)
+    return sorted(sorted_list_with_vbm, key=lambda x: date_index[x[1]], reverse=True)
+
+
 """Functions used for Original (Brute Force) Script"""
 
 
@@ -73,596 +325,699 @@ def output_list(master_list):
     return output
 
 
-def count_the_months(another_list):
-    """Counts the number of months.
+def parse_value(value):
+    """Parses the Value of a row, which is 0 if it is empty or not a number.
 
     Args:
-        another_list: input list of all the dates (some are repeating)
+        value: the Value of the row, as a string (an int is kept as it is)
 
-    Return:
-        length of set of dates or dictionary if dates per each measure are different
+    Returns:
+        value (int): the number of crossings
     """
+    if isinstance(value, int):
+        return value
+    return int(value) if value.isdigit() else 0
 
-    # Create a dates set and a measure dictionary
-    dates_set = set()
-    measure_dict = dict()
 
-    for row in another_list:
+def read_records(csv_reader):
+    """Keeps only the columns of each row the report needs.
 
-        # If the date is not in the set, then add it
-        if row[1] not in dates_set:
-            dates_set.add(row[1])
+    Args:
+        csv_reader: iterable of the rows read in from the csv file
 
-        # If the measure is in the dictionary, increase the count
-        if row[2] in measure_dict:
-            measure_dict[row[2]] += 1
-        else:
-            # Otherwise add it to the dictionary
-            measure_dict[row[2]] = 1
+    Yields:
+        record (tuple): (Border, Date, Measure, Value), where Value is 0
+                        if the 6th index of the row is not a number
+    """
 
-    # Remove the column name Measure
-    del(measure_dict['Measure'])
+    for row in csv_reader:
+        yield row[3], row[4], row[5], parse_value(row[6])
 
-    # Check for an empty dictionary first if that's possible
-    expected_value = next(iter(measure_dict.values()))
-    all_equal = all(value == expected_value for value in measure_dict.values())
 
-    return len(dates_set) if all_equal else measure_dict
+class InternedStrings(dict):
+    """Decodes each distinct byte string only once, and hands back the same
+       (interned) string object every time it is seen again.
+    """
 
+    def __missing__(self, raw):
+        string = sys.intern(raw.decode('utf-8'))
+        self[raw] = string
+        return string
 
-def check_all_there(the_list):
-    """Checks if all of the elements are not None or
-       if there is an empty list.
 
-    Keywords:
-    (list) the_list: input list of everything
+# Compressed input files, which are decompressed as they are read
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz', '.zip')
+
+
+def is_compressed(filename):
+    """Checks whether the input file is compressed (by its extension)."""
+
+    return filename.endswith(COMPRESSED_SUFFIXES)
+
+
+def open_input(filename, binary=False, background=False):
+    """Opens the input file, decompressing it as it is read if it is a .gz,
+       .bz2, .xz, or .zip (the csv file in it) file.
+
+    Args:
+        filename: name of the input file
+        binary: if True, read bytes instead of text
+        background: if True, decompress in a background thread (see
+                    compression.BackgroundReader)
 
     Returns:
-    (bool) True: if everything inside the list
+        infile: file object
     """
 
-    # For each row in the list
-    for row in the_list:
+    if not is_compressed(filename):
+        return open(filename, mode='rb' if binary else 'r')
 
-        # For each index in the row
-        for i, item in enumerate(row):
+    from compression import open_compressed
+    return open_compressed(filename, binary, background)
 
-            # If the row is empty, raise error
-            if not row[i]:
-                raise ValueError('Ehh, empty list, sir!')
-            else:
-                return True
 
-
-def calculate_average_crossing_per_month_and_measure(num_of_months, list_with_agg_values):
-    """Calculates the average crossings per month and per measure.
+def scan_records(filename):
+    """Scans a memory map of the input file line by line, splits each line
+       at its commas without decoding it, and decodes only the Border, Date,
+       Measure, and Value columns. The other columns (including the long
+       Location POINT) are never decoded, and the decoded strings are interned.
+       A line with quotes in it (or too few columns) is handed to the csv
+       module instead.
 
     Args:
-        num_of_months: the number of months based on the
-                       frequency of each measure, saved as
-                       a dict or a list.
-
-        list_with_agg_values: the list with Border, Date, Measure,
-                              and aggregated values.
+        filename: name of the input file
 
-    Returns:
-        list_with_avg (list): the list with the average crossing values
-                              per month and per measure
+    Yields:
+        record (tuple): (Border, Date, Measure, Value), where Value is 0
+                        if the 6th index of the row is not a number
     """
 
-    list_with_avg = []
+    strings = InternedStrings()
 
-    # Going through the list of aggregated valves backwards
-    # the list was sorted with the most recent date up first, so hence we are adding from the
-    # the bottom up and not top down direction
-    for i in range(len(list_with_agg_values) - 1, 0, -1):
-        each_row = list_with_agg_values[i]
-
-        # Now check whether the number of the months per measure is the same or not:
-        # If it's not, we going to calculate the average for each measure's frequency
-        if isinstance(num_of_months, dict):
-            for key, value in num_of_months.items():
-                if each_row[2] == key:
-                    if i % value == 0:
-                        accumulation, counter = 0, 0
-                        each_row = each_row + [0]
-                    else:
-                        # Add up each of the previous months' values
-                        each_row_before = list_with_agg_values[i + 1]
-                        accumulation += each_row_before[3]
-
-                        # Similarly add for each month to the counter
-                        counter += 1
-
-                        # For each row, get the average value of crossing based for each measure and border
-                        each_row = each_row + [my_round(accumulation / counter)]
-
-                    # And keep track in the list
-                    list_with_avg.append(each_row)
-        else:
-            # Otherwise, if the frequency is the same for all of the measures
-            if i % (num_of_months - 1) == 0:
-                accumulation, counter = 0, 0
-                each_row = each_row + [0]
-            else:
-                # Add up each of the previous months' values
-                each_row_before = list_with_agg_values[i + 1]
-                accumulation += each_row_before[3]
+    with open(filename, mode='rb') as infile:
 
-                # Similarly add for each month to the counter
-                counter += 1
+        # An empty file cannot be memory mapped
+        if os.fstat(infile.fileno()).st_size == 0:
+            return
 
-                # For each row, get the average value of crossing based for each measure and border
-                each_row = each_row + [my_round(accumulation / counter)]
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
 
-            # And keep track in the list
-            list_with_avg.append(each_row)
+            # Skip the column headers
+            data.readline()
 
-    return list_with_avg
+            for line in iter(data.readline, b''):
+                if b'"' not in line:
+
+                    # Port Name, State, Port Code, Border, Date, Measure,
+                    # Value, and the rest of the line
+                    fields = line.split(b',', 7)
+                    if len(fields) == 8:
+                        value = fields[6]
+                        yield (strings[fields[3]], strings[fields[4]], strings[fields[5]],
+                               int(value) if value.isdigit() else 0)
+                        continue
 
+                line = line.decode('utf-8').rstrip('\r\n')
+                if line:
+                    yield from read_records(csv.reader([line], delimiter=','))
 
-def write_to_csv(name_of_output_file, final_list):
-    """ Writes the file out to csv file row by row.
+
+def csv_records(filename, background=False):
+    """Reads the input file with the csv module.
 
     Args:
-        name_of_output_file: name of the output file
-        final_list: the list which holds all the border data information
+        filename: name of the input file
+        background: if True, decompress the input file in a background thread
 
-    Raises:
-        OSError: If the file does in fact exist
-        FileNotFoundError: If the file is not found
+    Yields:
+        record (tuple): (Border, Date, Measure, Value)
     """
 
-    try:
-        filepath = name_of_output_file
-    except OSError:
-        if pathlib.Path(name_of_output_file).resolve(strict=True):
-            pass
-        else:
-            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
-                                    name_of_output_file)
+    with open_input(filename, background=background) as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
 
-    # Write out to the output csv file
-    with open(filepath, mode='w') as csv_outfile:
-        outfile_writer = csv.writer(csv_outfile, delimiter=',', quotechar='"',
-                                    quoting=csv.QUOTE_NONE)
-
-        # Column headers--Don't quote them
-        outfile_writer.writerow(['Border', 'Date', 'Measure', 'Value', 'Average'])
+        # Skip the column headers
+        next(csv_reader, None)
 
-        outfile_writer = csv.writer(csv_outfile, delimiter=',', quotechar='"',
-                                    quoting=csv.QUOTE_MINIMAL)
+        yield from read_records(csv_reader)
 
-        # for each row in the final list, remove the list of list
-        # and create one list
-        for row in final_list:
-            outfile_writer.writerow(row)
 
+def csv_port_records(filename, background=False):
+    """Reads the input file with the csv module, keeping the Port Code too.
 
-"""Functions used for SQL Script"""
+    Args:
+        filename: name of the input file
+        background: if True, decompress the input file in a background thread
 
+    Yields:
+        record (tuple): (Port Code, Border, Date, Measure, Value)
+    """
 
-def convert_date_to_sql(filename):
-    """ Converts the date to the SQLite Datetime format"""
+    with open_input(filename, background=background) as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
 
-    # Read in the date
-    df = pd.read_csv(filename, sep=',')
+        # Skip the column headers
+        next(csv_reader, None)
 
-    # Because SQLite is particular about the Datetime format,
-    # I have to switch the format
-    df['Date'] = pd.to_datetime(df.Date)
-    df['Date'] = df['Date'].dt.strftime('%Y-%m-%d %I:%M:%S %p')
+        for row in csv_reader:
+            yield row[2], row[3], row[4], row[5], parse_value(row[6])
 
-    return df
 
+def input_records(filename, use_mmap=False, use_cache=False, background=False):
+    """Picks the input stage: the binary column cache, the memory-mapped
+       scanner, or the csv module. A compressed input file cannot be memory
+       mapped, so it is always streamed through the csv module.
 
-def convert_date_back_to_original_format(filename):
-    """ Converts Date back to the original format"""
+    Args:
+        filename: name of the input file
+        use_mmap: if True, scan a memory map of the input file
+        use_cache: if True, read the input through its binary column cache
+        background: if True, decompress the input file in a background thread
 
-    df = pd.read_csv(filename, sep=',')
+    Returns:
+        records: iterable of (Border, Date, Measure, Value) records
+    """
 
-    # Because SQLite is particular about the Datetime format,
-    # I have to switch back to the original format
-    df['Date'] = pd.to_datetime(df.Date)
-    df['Date'] = df['Date'].dt.strftime('%m/%d/%Y %I:%M:%S %p')
-    df.to_csv(path_or_buf=filename, index=False)
+    if use_cache:
+        from input_cache import cached_records
+        return cached_records(filename)
+    if use_mmap and not is_compressed(filename):
+        return scan_records(filename)
+    return csv_records(filename, background)
 
 
-"""Functions {and Class} used for Optimized Script"""
+def aggregate_crossings(records, totals=None):
+    """Streams the records one at a time and adds each value into a hash map
+       keyed by Border, Date, and Measure. Only the aggregated table is ever
+       held in memory, so memory depends on the number of distinct keys
+       and not on the size of the input file.
 
+    Args:
+        records: iterable of (Border, Date, Measure, Value) records
+        totals: dictionary of totals to add to (a new one by default)
 
-class NestedDict(dict):
+    Returns:
+        totals (dict): the aggregated value for each (Border, Date, Measure)
     """
-    Class for managing nested dictionary structures. Normally, it works
-    like a builtin dictionary. However, if it gets a list as an argument,
-    it will iterate through that list assuming all elements of that list
-    as a key for the subdirectory chain.
 
-    NestedDict implements module level functions and makes managing nested
-    dictionary structure easier.
+    if totals is None:
+        totals = dict()
+
+    for border, date, measure, value in records:
+        key = (border, date, measure)
+        totals[key] = totals.get(key, 0) + value
+
+    return totals
 
-    Instead of having a complicated way to manage extending or
-    overwriting, NestedDict has a lock property (not decorated!) which
-    allows or prohibits all alterations on the particular NestedDict
-    instance. Warning! If you do not pass a list (even if it has only one
-    element) to __setitem__, the superclass' method will be used which
-    sets the item regardless of lock state!
 
-    If you want more sophisticated behavior than full access/prohibition,
-    you can still use module level functions.
+def find_shards(filename, num_of_shards):
+    """Splits the input file (without its column headers) into byte ranges
+       that start and end on line boundaries.
+
+    Args:
+        filename: name of the input file
+        num_of_shards: number of byte ranges to split the file into
+
+    Returns:
+        shards (list): (filename, start, end) for each non-empty byte range
     """
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.lock = False
 
-    def __getitem__(self, *args):
-        if isinstance(args[0], list):
-            return getitem(self, args[0])
-        return super().__getitem__(*args)
+    size = os.path.getsize(filename)
 
-    def __setitem__(self, *args):
-        if isinstance(args[0], list):
-            lock = self.get_lock(args[0])
-            if not lock:
-                return setitem(self, args[0], args[1],
-                               overwrite=not lock, restruct=not lock,
-                               dict_type=type(self))
-            else:
-                return False
-        else:
-            super().__setitem__(*args)
-            return True
+    with open(filename, mode='rb') as infile:
 
-    def get_lock(self, path):
-        """
-        Returns the state of lock on the given path. In fact it walks on
-        the path as long as possible, and returns the state of the last
-        lock it can get.
-        """
-        lock = self.lock
-        level = 1
-        while level <= len(path):
-            try:
-                lock = getitem(self, path[:level]).lock
-            except (KeyError, AttributeError):
-                break
-            level += 1
-        return lock
+        # Skip the column headers
+        infile.readline()
+        boundaries = [infile.tell()]
 
-    def func_if_unlocked(self, *args):
-        """
-        The default func_if_unlocked function for self.merge() method
-        which checks for lock on a path and returns True if path is
-        unlocked.
-        """
-        path = args[0]
-        return not self.get_lock(path)
+        for i in range(1, num_of_shards):
+            offset = boundaries[0] + (size - boundaries[0]) * i // num_of_shards
 
-    def lock_close(self, recursively=True):
-        """
-        Locks locks.
-        """
-        self.lock = True
-        if recursively:
-            for p in self.paths(of_values=False):
-                self.__getitem__(p).lock = True
+            # Move to the start of the line after the offset, unless the
+            # offset already is the start of a line
+            infile.seek(max(offset - 1, boundaries[-1]))
+            infile.readline()
+            boundaries.append(max(infile.tell(), boundaries[-1]))
 
-    def lock_open(self, recursively=True):
-        """
-        Unlocks locks.
-        """
-        self.lock = False
-        if recursively:
-            for p in self.paths(of_values=False):
-                self.__getitem__(p).lock = False
+        boundaries.append(size)
 
-    def merge(self, *dictobjs, restruct=True):
-        """
-        Same as module level function merge. It needs less arguments
-        though since it uses self.func_if_unlocked() method to manage
-        extend and overwrite permissions.
-        """
-        merge(self, *dictobjs,
-              func_if_extend=self.func_if_unlocked,
-              func_if_overwrite=self.func_if_unlocked,
-              restruct=restruct,
-              dict_type=type(self))
+    return [(filename, start, end) for start, end in zip(boundaries, boundaries[1:])
+            if start < end]
 
-    def paths(self, of_values=True):
-        """
-        Same as module level function paths.
-        """
-        return paths(self, of_values=of_values)
 
+def aggregate_shard(shard):
+    """Parses and aggregates the lines of one byte range of the input file.
+       Runs inside a worker process, so it has to be a module level function.
 
-def getitem(dictobj, path):
-    """
-    Returns the element of a nested dictionary structure which is on the
-    given path.
+    Args:
+        shard: (filename, start, end, record_filter) of the byte range
+
+    Returns:
+        totals (dict): the aggregated value for each (Border, Date, Measure)
     """
-    _validate_path(path)
-    if len(path) == 1:
-        return dictobj[path[0]]
-    else:
-        return getitem(dictobj[path[0]], path[1:])
 
+    filename, start, end, record_filter = shard
 
-def setitem(dictobj, path, value, overwrite=True, restruct=True,
-        dict_type=dict):
-    """
-    Sets a dictionary item on a given path to a given value.
-      - Returns True if value on path has been set.
-      - Returns False if there was a value on the given path which was not
-        overwritten by the function.
-      - Returns None if there was a value on the given path which was
-        identical to value.
+    def lines_in_range(infile):
+        position = start
+        for line in infile:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
 
-    If restruct=True then when a value blocks the path, that value get
-    cleared by an empty dictionary to make way forward.
-    """
-    _validate_path(path)
+    with open(filename, mode='rb') as infile:
+        infile.seek(start)
+        return aggregate_crossings(record_filter(read_records(
+            csv.reader(lines_in_range(infile), delimiter=','))))
 
-    try:
-        one_step = dictobj[path[0]]
-    except KeyError:
-        if len(path) == 1:
-            dictobj[path[0]] = value
-            return True
-        else:
-            dictobj[path[0]] = dict_type()
-            one_step = dictobj[path[0]]
-    else:
-        if len(path) == 1 and one_step == value:
-            return None
-        elif len(path) == 1 and overwrite is False:
-            return False
-        elif len(path) == 1 and overwrite is True:
-            dictobj[path[0]] = value
-            return True
-        else:
-            if not isinstance(one_step, dict):
-                if overwrite is True and restruct is True: ##TEST
-                    dictobj[path[0]] = dict_type()
-                    one_step = dictobj[path[0]]
-                else:
-                    return False
-    return setitem(one_step, path[1:], value, overwrite=overwrite,
-                restruct=restruct, dict_type=dict_type)
 
+def aggregate_crossings_in_parallel(filename, workers, record_filter=None):
+    """Splits the input file into byte ranges, aggregates each of them in its
+       own worker process, and then merges the partial sums together.
+
+       Note: a row must not span more than one line (no quoted newlines).
+
+    Args:
+        filename: name of the input file
+        workers: number of worker processes
+        record_filter: RecordFilter the workers apply while parsing
 
-def paths(dictobj, of_values=True, past_keys=[]):
+    Returns:
+        totals (dict): the aggregated value for each (Border, Date, Measure)
     """
-    Generator to iterate through branches. Used by merge function, but
-    can be useful for other object management stuffs.
 
-    By default it returns paths of values. However, if of_values=False
-    then it returns the paths of all subdirectories.
+    # A compressed file cannot be split into byte ranges, so it is
+    # decompressed in one stream that hands its chunks out to the workers
+    if is_compressed(filename):
+        import asyncio
+        from pipeline import aggregate_pipeline
+        return asyncio.run(aggregate_pipeline(filename, workers, record_filter))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    totals = dict()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        shards = [shard + (record_filter or RecordFilter(),)
+                  for shard in find_shards(filename, workers)]
+        for partial_totals in executor.map(aggregate_shard, shards):
+            for key, value in partial_totals.items():
+                totals[key] = totals.get(key, 0) + value
+
+    return totals
+
+
+def check_all_there(the_list):
+    """Checks if all of the elements are not None or
+       if there is an empty list.
+
+    Keywords:
+    (list) the_list: input list of everything
+
+    Returns:
+    (bool) True: if everything inside the list
     """
-    for key in dictobj.keys():
-        path = past_keys + [key]
-        if not isinstance(dictobj[key], dict):
-            if of_values is True:
-                yield path
-        else:
-            if of_values is False:
-                yield path
-            yield from paths(dictobj[key], of_values=of_values,
-                             past_keys=path)
-
-
-def merge(*dictobjs,
-          func_if_extend=True,
-          func_if_overwrite=True,
-          restruct=True,
-          dict_type=dict,
-          return_new=False):
-    """
-    Merges one dictionary with one or more another.
-
-    By default it mutates the first dictobj. However, if return_new=True
-    then it returns a new dictionary object typed recursively to
-    dict_type. If you want no retypeing, use copy.deepcopy(), and pass the
-    copied dictionary as first argument.
-
-    To make mergeing more flexible, you are able to control how extension
-    overwriting should be done (both are allowed by default). By setting
-    func_if_overwrite to False, overwriting becomes disabled. By setting
-    func_if_extend to False, extension becomes disabled and you can only
-    update existing values if overwriting is enabled. If both are
-    disabled, no alteration will be made, so this scenario makes no sense,
-    but allowed.
-
-    Moreover you can pass functions to the two mentioned arguments which
-    will be called with the path (list of keys), dictobj1, dictobj2
-    arguments and expected to return True or False.
-    """
-    if return_new is True:
-        d = retype(dictobjs[0], dict_type)
-    elif return_new is False:
-        d = dictobjs[0]
-
-    for dictobj in dictobjs[1:]:
-        for p in paths(dictobj):
-            try:
-                getitem(d, p)
-            except KeyError:
-                    if hasattr(func_if_extend, '__call__'):
-                        ex = func_if_extend(p, d, dictobj)
-                    else:
-                        ex = func_if_extend
-                    if ex:
-                        setitem(d, p, getitem(dictobj, p),
-                                dict_type=dict_type)
-            else:
-                if getitem(d, p) != getitem(dictobj, p):
-                    if hasattr(func_if_overwrite, '__call__'):
-                        ow = func_if_overwrite(p, d, dictobj)
-                    else:
-                        ow = func_if_overwrite
-                    restruct_ = restruct and ow
-                    setitem(d, p, getitem(dictobj, p),
-                            overwrite=ow,
-                            restruct=restruct_,
-                            dict_type=dict_type)
-    return d
-
-
-def retype(dictobj, dict_type):
-    """
-    Recursively modifies the type of a dictionary object and returns a new
-    dictionary of type dict_type. You can also use this function instead
-    of copy.deepcopy() for dictionaries.
-    """
-    def walker(dictobj):
-        for k in dictobj.keys():
-            if isinstance(dictobj[k], dict):
-                yield (k, dict_type(walker(dictobj[k])))
+
+    # For each row in the list
+    for row in the_list:
+
+        # For each index in the row
+        for i, item in enumerate(row):
+
+            # If the row is empty, raise error
+            if not row[i]:
+                raise ValueError('Ehh, empty list, sir!')
             else:
-                yield (k, dictobj[k])
-    d = dict_type(walker(dictobj))
-    return d
+                return True
+
+
+class RunningAverage:
+    """Keeps a (running_sum, count) accumulator for each Border and Measure,
+       so the average of all the previous months can be found in O(1) for
+       every new month. The months of each Border and Measure must be added
+       in chronological order.
+    """
+
+    def __init__(self):
+        self.accumulators = dict()
 
+    def add(self, border, measure, value):
+        """Adds a month's aggregated value to the Border and Measure.
 
-def _validate_path(path):
-    if not isinstance(path, list):
-        raise TypeError('path argument have to be a list')
-    if not path:
-        raise Exception('path argument have to be a nonempty list')
+        Args:
+            border: name of border
+            measure: name of measure
+            value: the aggregated value for that month
 
+        Returns:
+            average (int): the rounded average of the previous months,
+                           or 0 if this is the first month
+        """
+
+        accumulator = self.accumulators.get((border, measure))
+
+        # The first month has nothing before it
+        if accumulator is None:
+            self.accumulators[(border, measure)] = [value, 1]
+            return 0
+
+        average = my_round(accumulator[0] / accumulator[1])
+        accumulator[0] += value
+        accumulator[1] += 1
+        return average
 
-def sum_values(measure_value):
-    """Sums all the measure values
+
+def calculate_running_average(list_with_agg_values, date_index):
+    """Calculates the average crossings of all the previous months for each
+       Border and Measure. Months missing from a series are simply not
+       counted, so series with gaps in them are averaged correctly.
 
     Args:
-        measure_value: Dictionary which holds the Date and Time as a key,
-                       and the value the current number of crossings and 0
+        list_with_agg_values: the list with Border, Date, Measure,
+                              and aggregated values (in any order).
+        date_index: DateIndex mapping each date to its ordinal month
+
     Returns:
-        the sum of all the measure values for that dictionary
+        list_with_avg (list): the list with the average crossing values
+                              per month and per measure
     """
-    for key, value in measure_value.items():
-        measure_value[key] = sum(value)
 
-    return measure_value
+    # Put the rows into a bucket for each month, so the months can be
+    # walked through in chronological order without sorting every row
+    months = dict()
+    for row in list_with_agg_values:
+        months.setdefault(date_index[row[1]], []).append(row)
+
+    running_average = RunningAverage()
+    list_with_avg = []
+    for month in sorted(months):
+        for border, date, measure, value in months[month]:
+            list_with_avg.append([border, date, measure, value,
+                                  running_average.add(border, measure, value)])
+
+    return list_with_avg
 
 
-def cumulative_average(values_list):
-    """" Gathers the cumulative average for each measure.
-         So if the values list has more than one value,
-         then there will be two numbers, the total sum at
-         that step as well as the cumulative average.
+def series_running_average(sorted_rows):
+    """Calculates the average crossings of all the previous months for each
+       Border and Measure, out of aggregated rows that are already in
+       (Border, Measure, Date) order, so no month buckets are needed and the
+       rows can be averaged as they go by.
 
     Args:
-        values_list: list of values of the specific measure
+        sorted_rows: iterable of Border, Date, Measure, and aggregated values,
+                     in chronological order within each Border and Measure
+
+    Yields:
+        row (list): the row with the average crossing value of the previous
+                    months of its measure
+    """
+
+    running_average = RunningAverage()
+    for border, date, measure, value in sorted_rows:
+        yield [border, date, measure, value, running_average.add(border, measure, value)]
 
-    Return:
-        list: if there are not multiple values, then return
-              the singular value and 0, otherwise return
-              the value at each step of the cumulative average.
+
+class ReportState:
+    """Aggregate state kept between runs, so that a new month of data can be
+       appended without reading the whole history again. For each Border and
+       Measure it holds the running sum and count of the running average, the
+       last month added, and the aggregated value of every month so far.
     """
 
-    if len(values_list) == 1:
-        for value in values_list:
-            return [tuple((value, 0))]
+    def __init__(self):
+        self.running_average = RunningAverage()
+        self.last_months = dict()
+        self.totals = dict()
 
-    new_list = [0] * len(values_list)
+    @classmethod
+    def load(cls, filename):
+        """Reads the state from a json file (an empty state if there is none).
 
-    new_p, counter = 0, 0
-    for i in range(len(values_list)-1, -1, -1):
-        new_list[i] = new_p
-        new_p += values_list[i]
+        Args:
+            filename: name of the state file
 
-        if counter >= 1:
-            new_list[i] = my_round(new_list[i]/counter)
+        Returns:
+            state (ReportState): the aggregate state
+        """
 
-        counter += 1
+        state = cls()
+        if not os.path.exists(filename):
+            return state
 
-    return list(zip(values_list, new_list))
+        import json
+        with open(filename, mode='r') as state_file:
+            for series in json.load(state_file)['series']:
+                key = (series['border'], series['measure'])
+                state.running_average.accumulators[key] = [series['running_sum'],
+                                                            series['count']]
+                state.last_months[key] = series['last_month']
+                state.totals[key] = series['totals']
 
+        return state
 
-def find_the_bloody_key(total_list, result_key, measure_key, measure_values):
-    """From the list of all the measure values, gets the values at each step.
-       For instance, at step 0, Cars passing in Canada-US border is 6,800. At
-       step 1, Cars passing in Canada-US border is 7,000--so the average is 14,800.
+    def save(self, filename):
+        """Writes the state out to a json file. It is written to a temporary
+           file first and then renamed over the old one, so an interrupted
+           run leaves the old state behind instead of a truncated one.
 
-       Args:
-           total_list: list of all measure values (number, and cumulative average)
-           result_key: name of border
-           measure_key: date and time entry
-           measure_values: value of measure
+        Args:
+            filename: name of the state file
+        """
 
-       Returns:
-            new_total_list: list of everything
-                            (<Border>, <Date>, <Measure>, <Value>, <Average>)
-                            nicely put together
+        accumulators = self.running_average.accumulators
+        series = [{'border': border, 'measure': measure,
+                   'running_sum': accumulators[(border, measure)][0],
+                   'count': accumulators[(border, measure)][1],
+                   'last_month': self.last_months[(border, measure)],
+                   'totals': totals}
+                  for (border, measure), totals in self.totals.items()]
+
+        import json
+        with open(filename + '.tmp', mode='w') as state_file:
+            json.dump({'series': series}, state_file)
+        os.replace(filename + '.tmp', filename)
+
+    def update(self, list_with_agg_values, date_index):
+        """Adds the new aggregated values to the state and calculates the
+           average crossings of only the report rows that are affected. New
+           months after the last month of a Border and Measure just continue
+           its running average. If an earlier month that was missing is
+           filled in, that month and every month after it are recalculated.
+
+           A month the state already holds is not added to again (appending
+           the same file twice would double it), so restating a month needs a
+           full rebuild of the state (a run with --state but without --append).
+
+        Args:
+            list_with_agg_values: the list with Border, Date, Measure,
+                                  and aggregated values of the new data.
+            date_index: DateIndex mapping each date to its ordinal month
+
+        Returns:
+            list_with_avg (list): the affected rows with their average crossing
+                                  values per month and per measure
 
         Raises:
-            IndexError: if total_list is emtpy
-            ValueError: if total list has less than one pair of measure value and
-                        cumulative sum.
-       """
+            ValueError: if a Border, Measure, and month is already in the state
+        """
 
-    if not total_list:
-        raise IndexError("Error! The list of cumulative average is empty.")
+        # Check every row before the state is changed, so a rejected input
+        # file leaves the state as it was
+        for border, date, measure, _ in list_with_agg_values:
+            if date in self.totals.get((border, measure), ()):
+                raise ValueError('{}, {}, {} is already in the aggregate state; restating '
+                                 'a month needs a full rebuild'.format(border, measure, date))
+
+        # Add the new values to the monthly totals, and find the first
+        # month of each Border and Measure that has changed
+        first_changed = dict()
+        for border, date, measure, value in list_with_agg_values:
+            totals = self.totals.setdefault((border, measure), {})
+            totals[date] = totals.get(date, 0) + value
+
+            month = date_index[date]
+            if month < first_changed.get((border, measure), month + 1):
+                first_changed[(border, measure)] = month
+
+        list_with_avg = []
+        for (border, measure), first_month in first_changed.items():
+            totals = self.totals[(border, measure)]
+
+            # If the change is not after the last month, start this Border
+            # and Measure over from the beginning
+            if first_month <= self.last_months.get((border, measure), first_month - 1):
+                del self.running_average.accumulators[(border, measure)]
+                months = totals
+            else:
+                months = [date for date in totals if date_index[date] >= first_month]
 
-    new_total_list = []
-    i = 0
-    for key in measure_values.keys():
+            for date in sorted(months, key=date_index.__getitem__):
+                month = date_index[date]
+                average = self.running_average.add(border, measure, totals[date])
+                if month >= first_month:
+                    list_with_avg.append([border, date, measure, totals[date], average])
 
-        # If the list has 1 value!
-        if len(list(chain(*total_list))) == 2 and total_list[0][0] in measure_values.values():
+            self.last_months[(border, measure)] = month
 
-            # saves in this order: <Border>, <Date>, <Measure>, <Value>, <Average>
-            return [result_key, key, measure_key, total_list[0][0], total_list[0][1]]
+        return list_with_avg
 
-        # if the list has more than 1 value
-        elif len(list(chain(*total_list))) > 2:
-            if total_list[i][0] in measure_values.values() and i < len(list(chain(*total_list))):
-                new_total_list.append([result_key, key, measure_key, total_list[i][0], total_list[i][1]])
-                i += 1
 
-        else:
-            raise ValueError("Error: total_list does not has less than one pair of values.")
+class ReportWriter:
+    """
+    Writes the report out a batch of rows at a time. Each batch is formatted
+    into one string (simply joined if none of its fields need quoting,
+    otherwise through csv.writer), and the encoded batches are kept in
+    a buffer that is flushed to the file in large writes. Output files
+    ending in .gz are gzip compressed, and .zst files zstd compressed
+    (which needs the zstandard package).
+    """
+
+    def __init__(self, name_of_output_file, windows=None, batch_rows=10000,
+                 buffer_size=1 << 20):
+        self._file = open_output(name_of_output_file)
+        self._buffer = []
+        self._buffered = 0
+        self.batch_rows = batch_rows
+        self.buffer_size = buffer_size
+
+        # Quotes only the fields that need it, like the csv module does
+        self._text = io.StringIO()
+        self._csv_writer = csv.writer(self._text, delimiter=',', quotechar='"',
+                                      quoting=csv.QUOTE_MINIMAL)
 
-    return new_total_list
+        # Column headers--Don't quote them
+        self.write(','.join(['Border', 'Date', 'Measure', 'Value', 'Average'] +
+                            window_headers(windows)) + '\r\n')
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, *exc_info):
+        self.close()
 
-def find_average(result):
-    """Iterate through the various keys and values,
-       until we find the specific one of interest. Find the cumulative average.
-       Place that in the final list, and sort it by the Date, Value, Measure, and
-       Border.
+    def format(self, rows):
+        """Formats the rows as csv text (with CRLF line endings, like csv.writer).
 
-       Args:
-           result: list of all the data
+        Args:
+            rows: the report rows
 
         Returns:
-            final_sorted_list: list of sorted items
+            text (str): the formatted rows
+        """
 
+        # Fast path: join the whole batch, then make sure no field held a
+        # comma, quote, line break, or None, which would need the csv module
+        text = '\r\n'.join([','.join(map(str, row)) for row in rows])
+        if (text.count(',') == sum(map(len, rows)) - len(rows)
+                and text.count('\n') == len(rows) - 1 and text.count('\r') == len(rows) - 1
+                and '"' not in text and 'None' not in text):
+            return text + '\r\n' if rows else ''
+
+        self._csv_writer.writerows(rows)
+        text = self._text.getvalue()
+        self._text.seek(0)
+        self._text.truncate()
+        return text
+
+    def write(self, text):
+        """Adds the formatted text to the buffer, and flushes the buffer out
+           once it is full."""
+
+        data = text.encode('utf-8')
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def write_rows(self, rows):
+        """Formats and writes the rows, a batch at a time.
+
+        Args:
+            rows: iterable of the report rows
+        """
+
+        rows = iter(rows)
+        batch = list(islice(rows, self.batch_rows))
+        while batch:
+            self.write(self.format(batch))
+            batch = list(islice(rows, self.batch_rows))
+
+    def flush(self):
+        """Writes the buffer out to the file in one call."""
+
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def open_output(name_of_output_file):
+    """Opens the output file for writing bytes, compressed by its extension.
+
+    Args:
+        name_of_output_file: name of the output file (.gz for gzip and .zst
+                             for zstd compressed output)
+
+    Returns:
+        outfile: binary file object
+
+    Raises:
+        ImportError: if a .zst file is asked for without the zstandard package
     """
 
-    all_list = []
+    if name_of_output_file.endswith('.gz'):
+        import gzip
+        return gzip.open(name_of_output_file, mode='wb', compresslevel=6)
 
-    for result_key, result_value in result.items():
-        for measure_key, measure_value in result_value.items():
+    if name_of_output_file.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Install the zstandard package to write .zst files!')
+        return zstandard.ZstdCompressor().stream_writer(open(name_of_output_file, mode='wb'))
 
-            measure_values = sum_values(measure_value)
+    return open(name_of_output_file, mode='wb')
 
-            new_table = [v for v in (measure_values.values())]
-            total_list = cumulative_average(new_table)
 
-            row = find_the_bloody_key(total_list, result_key, measure_key, measure_values)
+def write_to_csv(name_of_output_file, final_list, windows=None):
+    """ Writes the file out to csv file, a batch of rows at a time (see
+        ReportWriter).
+
+    Args:
+        name_of_output_file: name of the output file
+        final_list: the list which holds all the border data information
+        windows: the trailing average windows of the rows (see --windows)
+
+    Raises:
+        OSError: If the file does in fact exist
+        FileNotFoundError: If the file is not found
+    """
+
+    try:
+        filepath = name_of_output_file
+    except OSError:
+        import pathlib
+        if pathlib.Path(name_of_output_file).resolve(strict=True):
+            pass
+        else:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                    name_of_output_file)
+
+    # Write out to the output csv file
+    with ReportWriter(filepath, windows) as writer:
+        writer.write_rows(final_list)
 
-            if len(row) == 5:
-                all_list.append(row)
-            else:
-                all_list += row
 
-    # Sort the list by Date, Value, Measure, Border in descending order
-    sorted_list_with_val_border_measure = sorted(all_list, key=itemgetter(3, 2, 0),
-                                                 reverse=True)
-    final_sorted_list = sorted(sorted_list_with_val_border_measure,
-                               key=lambda x: datetime.strptime(x[1],
-                                                               '%d/%m/%Y %H:%M:%S %p'),
-                               reverse=True)
+def window_headers(windows):
+    """Returns the column headers of the trailing averages and the year over
+       year delta (none if there are no windows)."""
 
-    return final_sorted_list
+    if not windows:
+        return []
+    return ['Average_%dM' % window for window in windows] + ['YoY_Delta']